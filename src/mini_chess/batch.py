@@ -0,0 +1,160 @@
+"""
+Move generation over many positions at once with NumPy.
+
+A PositionBatch holds N positions of the same board size as an (N, 12)
+uint64 array of piece bitboards, indexed by piece code like
+BitBoard.pieces, and an (N,) array of sides to move. Boards are limited
+to 64 squares. Destination masks are computed for every position and
+square together: pawns, knights and kings read the Geometry tables, and
+sliders walk their rays one step at a time on whole arrays.
+
+Destinations match MiniChess.legal_targets, the stay move included. The
+action index of moving from a bit digit to another is
+from_digit * squares + to_digit.
+
+NumPy is an optional dependency, pip install mini_chess[numpy].
+"""
+
+import numpy as np
+
+from .bit_board import BLACK_OFFSET, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+from .geometry import get_geometry
+from .moves import MAX_SQUARES
+
+# (dy, dx) of the rays of rooks and bishops
+STRAIGHT_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+class BatchTables:
+    """ Geometry tables of a board size as uint64 arrays """
+
+    def __init__(self, row, col):
+        if row * col > MAX_SQUARES:
+            raise ValueError(f"Batched move generation supports up to {MAX_SQUARES} squares")
+        geometry = get_geometry(row, col)
+        self.row = row
+        self.col = col
+        self.squares = geometry.squares
+        self.full_mask = np.uint64(geometry.full_mask)
+        self.square_bits = np.array([1 << sq for sq in range(self.squares)], dtype=np.uint64)
+        self.knight_attacks = np.array(geometry.knight_attacks, dtype=np.uint64)
+        self.king_attacks = np.array(geometry.king_attacks, dtype=np.uint64)
+        self.pawn_pushes = np.array(geometry.pawn_pushes, dtype=np.uint64)
+        self.pawn_double_pushes = np.array(geometry.pawn_double_pushes, dtype=np.uint64)
+        self.pawn_attacks = np.array(geometry.pawn_attacks, dtype=np.uint64)
+
+        # Squares a ray may leave from without wrapping around a side of the board
+        full_mask = geometry.full_mask
+        self._leave = {
+            -1: np.uint64(full_mask ^ geometry.left_fence),
+            0: np.uint64(full_mask),
+            1: np.uint64(full_mask ^ geometry.right_fence),
+        }
+        self._steps = max(row, col) - 1
+
+    def slide(self, origins, occupancy, directions):
+        """ Ray attacks from the origin bits (N, S) through the occupancy (N, 1) """
+        attacks = np.zeros_like(origins)
+        for dy, dx in directions:
+            shift = dy * self.col + dx
+            amount = np.uint64(abs(shift))
+            leave = self._leave[dx]
+            ray = origins
+            for _ in range(self._steps):
+                ray = ray & leave
+                ray = (ray << amount) if shift > 0 else (ray >> amount)
+                ray &= self.full_mask
+                attacks |= ray
+                ray = ray & ~occupancy
+        return attacks
+
+
+_TABLES = {}
+
+
+def get_batch_tables(row, col):
+    tables = _TABLES.get((row, col))
+    if tables is None:
+        tables = _TABLES[(row, col)] = BatchTables(row, col)
+    return tables
+
+
+class PositionBatch:
+    def __init__(self, row, col, pieces, turns):
+        """ pieces: (N, 12) uint64 bitboards by piece code, turns: (N,) 0 for white, 1 for black """
+        self.tables = get_batch_tables(row, col)
+        self.row = row
+        self.col = col
+        self.pieces = np.asarray(pieces, dtype=np.uint64)
+        self.turns = np.asarray(turns, dtype=np.uint8)
+
+    @classmethod
+    def from_games(cls, games):
+        """ Batch of the positions of MiniChess games of the same size, pieces in flight left out """
+        games = list(games)
+        row, col = games[0].row, games[0].col
+        pieces = np.array([game.pieces for game in games], dtype=np.uint64).reshape(len(games), -1)
+        turns = np.array([game._turn for game in games], dtype=np.uint8)
+        return cls(row, col, pieces, turns)
+
+    def __len__(self):
+        return len(self.pieces)
+
+    @property
+    def action_space(self):
+        return self.tables.squares * self.tables.squares
+
+    def targets(self):
+        """ (N, S) uint64 destination masks of the side to move by from-digit, 0 off its pieces """
+        tables = self.tables
+        pieces = self.pieces
+        turns = self.turns.astype(np.intp)
+        black = turns.astype(bool)
+
+        white_pieces = np.bitwise_or.reduce(pieces[:, :BLACK_OFFSET], axis=1)
+        black_pieces = np.bitwise_or.reduce(pieces[:, BLACK_OFFSET:], axis=1)
+        own = np.where(black, black_pieces, white_pieces)[:, None]
+        enemy = np.where(black, white_pieces, black_pieces)[:, None]
+        occupancy = own | enemy
+        empty = ~occupancy & tables.full_mask
+        reachable = ~own & tables.full_mask
+
+        # Pieces of the side to move by type, (N, 1) each
+        offset = turns * BLACK_OFFSET
+        rows = np.arange(len(pieces))
+        own_type = [pieces[rows, offset + kind][:, None] for kind in range(BLACK_OFFSET)]
+        bits = tables.square_bits[None, :]
+
+        pushes = tables.pawn_pushes[turns] & empty
+        pushes |= np.where(pushes != 0, tables.pawn_double_pushes[turns] & empty, np.uint64(0))
+        pawns = pushes | (tables.pawn_attacks[turns] & enemy)
+
+        origins = np.broadcast_to(bits, (len(pieces), tables.squares))
+        straight = tables.slide(origins, occupancy, STRAIGHT_DIRECTIONS)
+        diagonal = tables.slide(origins, occupancy, DIAGONAL_DIRECTIONS)
+
+        targets = np.zeros(straight.shape, dtype=np.uint64)
+        moves = {
+            PAWN: pawns,
+            KNIGHT: tables.knight_attacks[None, :] & reachable,
+            BISHOP: diagonal & reachable,
+            ROOK: straight & reachable,
+            QUEEN: (straight | diagonal) & reachable,
+            KING: tables.king_attacks[None, :] & reachable,
+        }
+        for kind, kind_moves in moves.items():
+            on_square = (own_type[kind] & bits) != 0
+            targets = np.where(on_square, kind_moves, targets)
+
+        # Make staling a valid move
+        return np.where((own & bits) != 0, targets | bits, targets)
+
+    def legal_mask(self, flat=False):
+        """ Boolean (N, S, S) mask of [position, from-digit, to-digit], (N, S * S) if flat """
+        targets = self.targets()
+        squares = self.tables.squares
+        mask = ((targets[:, :, None] >> np.arange(squares, dtype=np.uint64)) & np.uint64(1)).astype(bool)
+        if flat:
+            return mask.reshape(len(targets), squares * squares)
+        return mask
@@ -0,0 +1,298 @@
+"""
+Benchmarks of the library, run with python -m mini_chess.benchmark COMMAND
+or the mini-chess-bench script
+
+run     perft counts checked against PERFT_REFERENCE and rates of the hot paths
+memory  average bytes held by a live game
+profile calls and time of the hot paths over random games, see profiling.py
+copy    rates of clone, copy.deepcopy, reset and a GamePool, clone checked
+        CLONE_SPEEDUP times faster than deepcopy at least
+"""
+
+import argparse
+import copy
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from .mini_chess import MiniChess
+from .profiling import Profiler
+from .pool import GamePool
+from .board_example import GARDNER_BOARD, SILVERMAN_BOARD, LOS_ALAMOS_BOARD, STANDARD_BOARD
+
+BOARDS = {
+    "gardner": GARDNER_BOARD,
+    "silverman": SILVERMAN_BOARD,
+    "los_alamos": LOS_ALAMOS_BOARD,
+    "standard": STANDARD_BOARD,
+}
+MOVE_TIMES = (1, 2, 3)
+
+# Least ratio of the clone rate to the deepcopy rate for bench_copies to pass
+CLONE_SPEEDUP = 10
+
+# perft of the starting position by (board, move_time), from depth 1
+PERFT_REFERENCE = {
+    ("gardner", 1): (17, 293, 5336, 97975),
+    ("gardner", 2): (17, 294, 5398, 100274),
+    ("gardner", 3): (17, 294, 5140, 91053),
+    ("silverman", 1): (12, 146, 1905, 25140),
+    ("silverman", 2): (12, 148, 1965, 26468),
+    ("silverman", 3): (12, 148, 1917, 25106),
+    ("los_alamos", 1): (28, 772, 21934, 613864),
+    ("los_alamos", 2): (28, 784, 22644, 645454),
+    ("los_alamos", 3): (28, 784, 22076, 612054),
+    ("standard", 1): (36, 1296, 48278, 1797676),
+    ("standard", 2): (36, 1296, 48276, 1798369),
+    ("standard", 3): (36, 1296, 47820, 1763442),
+}
+
+
+def sample_positions(board, move_time=1, count=50, max_plies=12, seed=0):
+    """ Games after a random number of random plies, with the side to move set """
+    rng = random.Random(seed)
+    games = []
+    while len(games) < count:
+        game = MiniChess(board, move_time)
+        for ply in range(rng.randrange(max_plies)):
+            game.cur_color("w" if ply % 2 == 0 else "b")
+            game.push(rng.choice(list(game.generate_all_moves())))
+            game.update_time()
+            if game.has_winner() is not None:
+                break
+        if game.has_winner() is None:
+            games.append(game)
+    return games
+
+
+def _rate(op, positions, min_time):
+    # Units per second of op over the (game, move) positions, op returning its units,
+    # repeated for min_time at least
+    units = 0
+    start = time.perf_counter()
+    while True:
+        for game, move in positions:
+            units += op(game, move)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return units / elapsed
+
+
+def _movegen(game, move):
+    # Drop the cached masks to time the generation itself
+    game._legal_targets = None
+    return sum(1 for _ in game.generate_all_moves())
+
+
+def _movegen_encoded(game, move):
+    return len(game.generate_moves_encoded())
+
+
+def _push(game, move):
+    game.push(move)
+    game.pop()
+    return 1
+
+
+def _update_time(game, move):
+    game.update_time()
+    game.rewind_time()
+    return 1
+
+
+def _is_in_check(game, move):
+    game.is_in_check(game._turn)
+    return 1
+
+
+def _has_winner(game, move):
+    game.has_winner()
+    return 1
+
+
+# Units are moves for movegen, calls otherwise; push and update_time are undone after each call
+HOT_PATHS = {
+    "movegen": _movegen,
+    "movegen_encoded": _movegen_encoded,
+    "push": _push,
+    "update_time": _update_time,
+    "is_in_check": _is_in_check,
+    "has_winner": _has_winner,
+}
+
+
+def bench_board(board, move_time=1, depth=3, min_time=0.2, seed=0):
+    """ perft of the starting position and per second rates of the hot paths on sampled positions """
+    rng = random.Random(seed)
+    games = sample_positions(board, move_time, seed=seed)
+    for game in games:
+        # For pop and rewind_time
+        game.keep_undo = True
+    positions = [(game, rng.choice(list(game.generate_all_moves()))) for game in games]
+    rates = {name: _rate(op, positions, min_time) for name, op in HOT_PATHS.items()}
+
+    game = MiniChess(board, move_time)
+    start = time.perf_counter()
+    nodes = game.perft(depth)
+    elapsed = time.perf_counter() - start
+    return {"perft": {"depth": depth, "nodes": nodes, "nodes_per_sec": nodes / elapsed},
+            "rates": rates}
+
+
+def run(boards=tuple(BOARDS), move_times=MOVE_TIMES, depth=3, min_time=0.2):
+    """ bench_board over boards and move times, perft counts checked against PERFT_REFERENCE """
+    results = []
+    ok = True
+    for name in boards:
+        for move_time in move_times:
+            result = bench_board(BOARDS[name], move_time, depth, min_time)
+            reference = PERFT_REFERENCE.get((name, move_time), ())
+            expected = reference[depth - 1] if 0 < depth <= len(reference) else None
+            result["perft"]["expected"] = expected
+            result["perft"]["ok"] = expected is None or expected == result["perft"]["nodes"]
+            ok = ok and result["perft"]["ok"]
+            results.append({"board": name, "move_time": move_time, **result})
+    return {"ok": ok, "python": sys.version.split()[0], "results": results}
+
+
+def game_footprint(board=GARDNER_BOARD, move_time=1, games=1000, plies=6, seed=0):
+    """ Average bytes held by a live game after plies random pushes, measured with tracemalloc """
+    rng = random.Random(seed)
+    # Shared tables are built once per board size and don't count per game
+    MiniChess(board, move_time)
+
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        live = []
+        for _ in range(games):
+            game = MiniChess(board, move_time)
+            for ply in range(plies):
+                game.cur_color("w" if ply % 2 == 0 else "b")
+                game.push(rng.choice(list(game.generate_all_moves())))
+            live.append(game)
+        size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+
+    return {"games": games, "plies": plies, "move_time": move_time,
+            "in_flight": sum(len(game._moving_queue) for game in live) / games,
+            "bytes_per_game": size / games}
+
+
+def bench_copies(board=GARDNER_BOARD, move_time=3, min_time=0.2, seed=0):
+    """ Per second rates of the ways to get a game: copies of sampled positions, new games, reset and a pool """
+    games = sample_positions(board, move_time, seed=seed)
+    positions = [(game, None) for game in games]
+    pool = GamePool(board, move_time)
+    scratch = MiniChess(board, move_time)
+
+    def pooled(game, move):
+        pool.release(pool.acquire())
+        return 1
+
+    rates = {
+        "clone": _rate(lambda game, move: game.clone() and 1, positions, min_time),
+        "deepcopy": _rate(lambda game, move: copy.deepcopy(game) and 1, positions, min_time),
+        "new": _rate(lambda game, move: MiniChess(board, move_time) and 1, positions, min_time),
+        "reset": _rate(lambda game, move: scratch.reset(board) or 1, positions, min_time),
+        "pool": _rate(pooled, positions, min_time),
+    }
+    speedup = rates["clone"] / rates["deepcopy"]
+    return {"rates": rates, "clone_speedup": speedup, "ok": speedup >= CLONE_SPEEDUP}
+
+
+def profile_games(board=GARDNER_BOARD, move_time=1, games=100, max_plies=200, seed=0, profiler=None):
+    """ Snapshot of a Profiler over games of random moves, one ply per tick as in sample_positions """
+    rng = random.Random(seed)
+    profiler = Profiler() if profiler is None else profiler
+    game = profiler.instrument(MiniChess(board, move_time))
+    for _ in range(games):
+        game.reset(board)
+        for ply in range(max_plies):
+            game.cur_color("w" if ply % 2 == 0 else "b")
+            moves = list(game.generate_all_moves())
+            if moves:
+                game.push(rng.choice(moves))
+            game.update_time()
+            if game.has_winner() is not None:
+                break
+            game.is_in_check(game._turn)
+    return profiler.snapshot()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mini_chess.benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("run", help="perft check and rates of the hot paths")
+    bench.add_argument("--boards", nargs="+", choices=tuple(BOARDS), default=tuple(BOARDS))
+    bench.add_argument("--move-times", nargs="+", type=int, default=MOVE_TIMES)
+    bench.add_argument("--depth", type=int, default=3)
+    bench.add_argument("--min-time", type=float, default=0.2, help="seconds spent per hot path")
+    bench.add_argument("--output", help="write the results as JSON to that file")
+
+    memory = commands.add_parser("memory", help="average bytes held by a live game")
+    memory.add_argument("--games", type=int, default=1000)
+    memory.add_argument("--plies", type=int, default=6)
+    memory.add_argument("--move-time", type=int, default=10)
+    memory.add_argument("--json", action="store_true", help="print the result as JSON")
+
+    profile = commands.add_parser("profile", help="calls and time of the hot paths over random games")
+    profile.add_argument("--board", choices=tuple(BOARDS), default="gardner")
+    profile.add_argument("--games", type=int, default=100)
+    profile.add_argument("--move-time", type=int, default=1)
+    profile.add_argument("--prometheus", help="write the counters in Prometheus text format to that file")
+
+    copies = commands.add_parser("copy", help="rates of clone, deepcopy, reset and pooling")
+    copies.add_argument("--board", choices=tuple(BOARDS), default="gardner")
+    copies.add_argument("--move-time", type=int, default=3)
+    copies.add_argument("--min-time", type=float, default=0.2, help="seconds spent per way")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        report = run(args.boards, args.move_times, args.depth, args.min_time)
+        for result in report["results"]:
+            perft = result["perft"]
+            status = "ok" if perft["ok"] else f"MISMATCH, expected {perft['expected']}"
+            print(f"{result['board']:<11} move_time {result['move_time']}  "
+                  f"perft({perft['depth']}) {perft['nodes']} {status}, {perft['nodes_per_sec']:.0f} nodes/s")
+            print("    " + "  ".join(f"{name} {rate:.0f}/s" for name, rate in result["rates"].items()))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+        return 0 if report["ok"] else 1
+
+    if args.command == "memory":
+        result = game_footprint(move_time=args.move_time, games=args.games, plies=args.plies)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{result['bytes_per_game']:.0f} bytes per game, "
+                  f"{result['in_flight']:.1f} pieces in flight, move_time {result['move_time']}")
+
+    if args.command == "profile":
+        profiler = Profiler()
+        snapshot = profile_games(BOARDS[args.board], args.move_time, args.games, profiler=profiler)
+        methods = sorted(snapshot["methods"].items(), key=lambda item: -item[1]["seconds"])
+        for name, method in methods:
+            print(f"{name:<24} {method['calls']:>9} calls {method['seconds']:9.3f}s "
+                  f"{method['seconds'] / method['calls'] * 1e6:8.2f} us/call")
+        print(f"{snapshot['nodes_generated']} nodes generated, {snapshot['positions_cached']} positions cached, "
+              f"{snapshot['arrivals_landed']} arrivals landed")
+        if args.prometheus:
+            profiler.dump(args.prometheus)
+
+    if args.command == "copy":
+        result = bench_copies(BOARDS[args.board], args.move_time, args.min_time)
+        print("  ".join(f"{name} {rate:.0f}/s" for name, rate in result["rates"].items()))
+        status = "ok" if result["ok"] else f"below {CLONE_SPEEDUP}x"
+        print(f"clone {result['clone_speedup']:.0f}x faster than deepcopy, {status}")
+        return 0 if result["ok"] else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
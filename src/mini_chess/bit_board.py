@@ -13,23 +13,44 @@ Bit digit on board
 +---+---+---+---+---+
 """
 
+from .geometry import get_geometry
+from .sliders import RANK, FILE
+
+# Piece codes index BitBoard.pieces, white pieces first: code = color * 6 + type
+PIECE_TYPES = "pnbrqk"
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+BLACK_OFFSET = len(PIECE_TYPES)
+PIECE_SYMBOLS = "PNBRQKpnbrqk"
+PIECE_CODES = {symbol: code for code, symbol in enumerate(PIECE_SYMBOLS)}
+# Material value by piece type, a king capture ends the game
+PIECE_VALUES = (1, 3, 3, 5, 9, 1000)
+
 class BitBoard:
+    __slots__ = ("col", "row", "geometry", "board_mask", "white_pieces", "black_pieces", "pieces")
+
     def __init__(self, board):
         self.col = len(board[0])
         self.row = len(board)
-        self.board_mask = [((1 << self.col) - 1) << (y * self.col) for y in range(self.row)]
+        # Masks are shared by all boards of the same size
+        self.geometry = get_geometry(self.row, self.col)
+        self.board_mask = self.geometry.board_mask
         # Initialize the board with starting positions
         self.white_pieces = 0
         self.black_pieces = 0
+        # One bitboard per piece code
+        self.pieces = [0] * len(PIECE_SYMBOLS)
 
         for y in range(self.row):
             for x in range(self.col):
                 piece = board[y][x]
                 if piece == ".":
                     continue
+                if piece not in PIECE_CODES:
+                    raise ValueError(f"Unknown piece {piece!r} at row {y}, col {x}")
 
                 # Set the corresponding bit in the bitboard
                 bit_digit = y * self.col + x
+                self.pieces[PIECE_CODES[piece]] |= (1 << bit_digit)
                 if piece.isupper():
                     self.white_pieces |= (1 << bit_digit)
                 else:
@@ -55,343 +76,190 @@ class BitBoard:
             return self.black_pieces
 
     def mirror(self, board):
+        # Flip the rows, from white's to black's perspective and back
         mirrored_board = 0
-        mid_index = len(self.board_mask) // 2
-        even = 1 if (len(self.board_mask) % 2 == 0) else 0
-
-        for i, row in enumerate(self.board_mask):
-            if i <= mid_index:
-                mirrored_board |= (board & row) << (self.col * (mid_index - i) * 2 + even)
+        last_row = self.row - 1
+        for y, row in enumerate(self.board_mask):
+            shift = self.col * (last_row - 2 * y)
+            if shift >= 0:
+                mirrored_board |= (board & row) << shift
             else:
-                mirrored_board |= (board & row) >> (self.col * (i - mid_index) * 2 - even)
+                mirrored_board |= (board & row) >> -shift
 
         return mirrored_board
             
+    def piece_code_at(self, bit_digit):
+        """ Piece code on the bit digit, None if it's empty """
+        bit = 1 << bit_digit
+        if self.white_pieces & bit:
+            code = 0
+        elif self.black_pieces & bit:
+            code = BLACK_OFFSET
+        else:
+            return None
+
+        pieces = self.pieces
+        while not pieces[code] & bit:
+            code += 1
+        return code
+
+    def lift(self, bit_digit):
+        """ Remove the piece on the bit digit, return its code """
+        code = self.piece_code_at(bit_digit)
+        if code is not None:
+            bit = 1 << bit_digit
+            self.pieces[code] ^= bit
+            if code < BLACK_OFFSET:
+                self.white_pieces ^= bit
+            else:
+                self.black_pieces ^= bit
+        return code
+
+    def land(self, bit_digit, code):
+        """ Put a piece on the bit digit, return the code of the piece it captured """
+        captured = self.lift(bit_digit)
+        bit = 1 << bit_digit
+        self.pieces[code] |= bit
+        if code < BLACK_OFFSET:
+            self.white_pieces |= bit
+        else:
+            self.black_pieces |= bit
+        return captured
+
+    def iter_bits(self, bits):
+        # Bit digits of the set bits, lowest first
+        while bits:
+            low_bit = bits & -bits
+            yield low_bit.bit_length() - 1
+            bits ^= low_bit
+
     def piece_up(self, from_x, from_y):
-        # Compute the bit indices of the source and destination squares
-        from_bit_digit = from_y * self.col + from_x
-        
         # Remove the source piece from the bitboard
-        if self.white_pieces & (1 << from_bit_digit):
-            self.white_pieces &= ~(1 << from_bit_digit)
-        else:
-            self.black_pieces &= ~(1 << from_bit_digit)
+        return self.lift(from_y * self.col + from_x)
             
-    def piece_down(self, to_x, to_y, is_white):
-        to_bit_digit = to_y * self.col + to_x
-        
+    def piece_down(self, to_x, to_y, piece, is_white):
         # Add the destination piece to the bitboard
-        if is_white:
-            self.white_pieces |= (1 << to_bit_digit)
-            self.black_pieces &= ~(1 << to_bit_digit)
-        else:
-            self.black_pieces |= (1 << to_bit_digit)
-            self.white_pieces &= ~(1 << to_bit_digit)
-        
+        code = PIECE_TYPES.index(piece.lower()) + (0 if is_white else BLACK_OFFSET)
+        return self.land(to_y * self.col + to_x, code)
 
     def digit_to_coords(self, digit):
-        return (digit % self.col, digit // self.row)
+        return (digit % self.col, digit // self.col)
 
     def generate_valid_moves(self, x, y, piece):
         bit_digit = y * self.col + x
         board = self.white_pieces | self.black_pieces
-        enemy = self.black_pieces
 
         assert (1 << bit_digit) & board, "No piece found at the given bit!"
 
-        if self.black_pieces & (1 << bit_digit):        
-            mirrored_white = self.mirror(self.white_pieces)
-            mirrored_black = self.mirror(self.black_pieces)
-            bit_digit = (self.row - y - 1) * self.col + x
-            board = mirrored_white | mirrored_black
-            enemy = mirrored_white
+        # Moves are computed on absolute positions for both colors, black's are
+        # only flipped to its perspective when yielded
+        is_black = bool(self.black_pieces & (1 << bit_digit))
+        code = PIECE_TYPES.index(piece) + (BLACK_OFFSET if is_black else 0)
+        moves = (1 << bit_digit) | self.piece_targets(bit_digit, code) # Make staling a valid move
         
-        moves = (1 << bit_digit) # Make staling a valid move
-        if piece == 'p':
-            moves |= self.pawn_valid_moves(bit_digit, board, enemy)
-        elif piece == 'r':
-            moves |= self.rook_valid_moves(bit_digit, board, enemy)
-        elif piece == 'n':
-            moves |= self.knight_valid_moves(bit_digit, board, enemy)
-        elif piece == 'b':
-            moves |= self.bishop_valid_moves(bit_digit, board, enemy)
-        elif piece == 'q':
-            moves |= self.queen_valid_moves(bit_digit, board, enemy)
-        elif piece == 'k':
-            moves |= self.king_valid_moves(bit_digit, board, enemy)
-        
-        bit_at = 0
-        while moves != 0:
-            if moves & 1:
-                yield self.digit_to_coords(bit_at)
-            moves = moves >> 1
-            bit_at += 1
+        for bit_at in self.iter_bits(moves):
+            to_x, to_y = self.digit_to_coords(bit_at)
+            if is_black:
+                to_y = self.row - to_y - 1
+            yield to_x, to_y
+
+    def piece_targets(self, bit_digit, code):
+        """ Destination mask of the piece code on the bit digit, staying excluded """
+        # Absolute positions, the per-color tables give pawns their direction
+        geometry = self.geometry
+        if code < BLACK_OFFSET:
+            color, kind = 0, code
+            own, enemy = self.white_pieces, self.black_pieces
+        else:
+            color, kind = 1, code - BLACK_OFFSET
+            own, enemy = self.black_pieces, self.white_pieces
+        board = own | enemy
+        reachable = geometry.full_mask ^ own
+
+        if kind == PAWN:
+            empty = geometry.full_mask ^ board
+            moves = geometry.pawn_pushes[color][bit_digit] & empty
+            if moves:
+                moves |= geometry.pawn_double_pushes[color][bit_digit] & empty
+            return moves | (geometry.pawn_attacks[color][bit_digit] & enemy)
+        if kind == KNIGHT:
+            return geometry.knight_attacks[bit_digit] & reachable
+        if kind == KING:
+            return geometry.king_attacks[bit_digit] & reachable
+        if kind == ROOK:
+            return geometry.sliders.rook_attacks(bit_digit, board) & reachable
+        if kind == BISHOP:
+            return geometry.sliders.bishop_attacks(bit_digit, board) & reachable
+        return geometry.sliders.queen_attacks(bit_digit, board) & reachable
+
+    def attackers_to(self, bit_digit, color):
+        """ Bitboard of the pieces of the color (0 white, 1 black) attacking the bit digit """
+        # Pieces attack back along the same lines, except for pawns which look the other way
+        geometry = self.geometry
+        pieces = self.pieces
+        offset = color * BLACK_OFFSET
+        attackers = geometry.pawn_attacks[1 - color][bit_digit] & pieces[offset + PAWN]
+        attackers |= geometry.knight_attacks[bit_digit] & pieces[offset + KNIGHT]
+        attackers |= geometry.king_attacks[bit_digit] & pieces[offset + KING]
+
+        board = self.white_pieces | self.black_pieces
+        straight = pieces[offset + ROOK] | pieces[offset + QUEEN]
+        if straight:
+            attackers |= geometry.sliders.rook_attacks(bit_digit, board) & straight
+        diagonal = pieces[offset + BISHOP] | pieces[offset + QUEEN]
+        if diagonal:
+            attackers |= geometry.sliders.bishop_attacks(bit_digit, board) & diagonal
+        return attackers
 
     # All mask calculations are using positions of the player's perspective
 
     def get_fence_mask(self):
-        left_fence = 0
-        right_fence = 0
-        for row in self.board_mask:
-            bin_str = bin(row)[2:]
-            left_1_bit_at = bin_str.find('1')
-            right_fence |= int("1" + "0" * (len(bin_str) - (left_1_bit_at + 1)), 2)
-            right_1_bit_at = bin_str.rfind('1')
-            left_fence |= int(bin_str[right_1_bit_at:], 2)
-        
-        return left_fence, right_fence
+        return self.geometry.left_fence, self.geometry.right_fence
     
     # Contain the complement bits in the board's size
     def get_bits_complement(self, bits):
-        return ~bits & sum(self.board_mask)
+        return ~bits & self.geometry.full_mask
 
     def pawn_valid_moves(self, bit_digit, board, enemy):
-        pos = 1 << bit_digit
-        move_mask = 0
-        attack_mask = 0
-
-        if (pos >> self.col) & self.get_bits_complement(board):
-            move_mask |= pos >> self.col 
-            # Two steps forward when at its default position
-            if pos & self.board_mask[-2] and (move_mask >> self.col) & self.get_bits_complement(board):
-                move_mask |= move_mask >> self.col
-
-        left_fence, right_fence = self.get_fence_mask()
+        geometry = self.geometry
+        empty = geometry.full_mask ^ board
+        move_mask = geometry.pawn_pushes[0][bit_digit] & empty
+        # Two steps forward when at its default position
+        if move_mask:
+            move_mask |= geometry.pawn_double_pushes[0][bit_digit] & empty
 
         # Attack moves
-        if pos & self.get_bits_complement(left_fence):
-            attack_mask |= pos >> (self.col + 1)
-        if pos & self.get_bits_complement(right_fence):
-            attack_mask |= pos >> (self.col - 1)
-        attack_mask &= enemy
+        attack_mask = geometry.pawn_attacks[0][bit_digit] & enemy
 
-        return (move_mask | attack_mask) & sum(self.board_mask)
+        return move_mask | attack_mask
     
     def knight_valid_moves(self, bit_digit, board, enemy):
-        pos = 1 << bit_digit
-        move_mask = 0
-        attack_mask = 0
-
-        left_fence, right_fence = self.get_fence_mask()
-
-        # * . *
-        # . . .
-        #   N
-        to_up = 0
-        if pos & self.get_bits_complement(left_fence):
-            to_up |= (pos >> (self.col * 2)) >> 1
-        if pos & self.get_bits_complement(right_fence):
-            to_up |= (pos >> (self.col * 2)) << 1
-        move_mask |= to_up & self.get_bits_complement(board)
-        attack_mask |= to_up & enemy
-
-        #   N
-        # . . .
-        # * . *
-        to_down = 0
-        if pos & self.get_bits_complement(left_fence): 
-            to_down |= (pos << (self.col * 2)) >> 1
-        if pos & self.get_bits_complement(right_fence):
-            to_down |= (pos << (self.col * 2)) << 1
-        move_mask |= to_down & self.get_bits_complement(board)
-        attack_mask |= to_down & enemy
-
-        valid_row_bits = self.board_mask[bit_digit // self.row]
-        
-        # * . . 
-        # . . . N
-        # * . .
-        to_left = ((pos >> 2) & valid_row_bits) >> self.col
-        to_left |= ((pos >> 2) & valid_row_bits) << self.col
-        move_mask |= to_left & self.get_bits_complement(board)
-        attack_mask |= to_left & enemy
-
-        #   . . *
-        # N . . .
-        #   . . *
-        to_right = ((pos << 2) & valid_row_bits) >> self.col
-        to_right |= ((pos << 2) & valid_row_bits) << self.col
-        move_mask |= to_right & self.get_bits_complement(board)
-        attack_mask |= to_right & enemy
-
-        return (move_mask | attack_mask) & sum(self.board_mask)        
+        # Empty squares or enemy pieces within the knight's reach
+        return self.geometry.knight_attacks[bit_digit] & ((self.geometry.full_mask ^ board) | enemy)
     
     def king_valid_moves(self, bit_digit, board, enemy):
-        pos = 1 << bit_digit
-        move_mask = 0
-        attack_mask = 0
-
-        left_fence, right_fence = self.get_fence_mask()
-
-        if pos & self.get_bits_complement(left_fence):
-            # Up left
-            move_mask |= (pos >> (self.col + 1)) & self.get_bits_complement(board)
-            attack_mask |= (pos >> (self.col + 1)) & enemy
-            # Left
-            move_mask |= (pos >> 1) & self.get_bits_complement(board)
-            attack_mask |= (pos >> 1) & enemy
-            # Down left
-            move_mask |= (pos << (self.col - 1)) & self.get_bits_complement(board)
-            attack_mask |= (pos << (self.col - 1)) & enemy
-
-        # Up
-        move_mask |= (pos >> self.col) & self.get_bits_complement(board)
-        attack_mask |= pos >> (self.col) & enemy
-        # Down
-        move_mask |= (pos << self.col) & self.get_bits_complement(board)
-        attack_mask |= pos << (self.col) & enemy
-
-        if pos & self.get_bits_complement(right_fence):
-            # Up right
-            move_mask |= (pos >> (self.col - 1)) & self.get_bits_complement(board)
-            attack_mask |= (pos >> (self.col - 1)) & enemy
-            # Right
-            move_mask |= (pos << 1) & self.get_bits_complement(board)
-            attack_mask |= (pos << 1) & enemy
-            # Down right
-            move_mask |= (pos << (self.col + 1)) & self.get_bits_complement(board)
-            attack_mask |= (pos << (self.col + 1)) & enemy
-
-        return (move_mask | attack_mask) & sum(self.board_mask)
+        return self.geometry.king_attacks[bit_digit] & ((self.geometry.full_mask ^ board) | enemy)
 
     def row_valid_moves(self, bit_digit, board, enemy):
-        pos = 1 << bit_digit
-        valid_row_bits = pos ^ self.board_mask[bit_digit // self.row]
-        move_mask = 0
-        attack_mask = 0
-
-        to_left = pos >> 1
-        while to_left & valid_row_bits:
-            if to_left & board:
-                if to_left & enemy:
-                    attack_mask |= to_left
-                break
-            move_mask |= to_left
-            to_left >>= 1
-
-        to_right = pos << 1 
-        while to_right & valid_row_bits:
-            if to_right & board:
-                if to_right & enemy:
-                    attack_mask |= to_right
-                break
-            move_mask |= to_right
-            to_right <<= 1
-        
-        return move_mask, attack_mask
+        attacks = self.geometry.sliders.line_attacks(RANK, bit_digit, board)
+        return attacks & ~board, attacks & enemy
 
     def col_valid_moves(self, bit_digit, board, enemy):
-        pos = 1 << bit_digit
-        move_mask = 0
-        attack_mask = 0
-
-        to_up = pos >> self.col
-        while to_up & sum(self.board_mask):
-            if to_up & board:
-                if to_up & enemy:
-                    attack_mask |= to_up
-                break
-            move_mask |= to_up
-            to_up >>= self.col
-
-        to_down = pos << self.col
-        while to_down & sum(self.board_mask):
-            if to_down & board:
-                if to_down & enemy:
-                    attack_mask |= to_down
-                break
-            move_mask |= to_down
-            to_down <<= self.col
-        
-        return move_mask, attack_mask
+        attacks = self.geometry.sliders.line_attacks(FILE, bit_digit, board)
+        return attacks & ~board, attacks & enemy
 
     def diag_valid_moves(self, bit_digit, board, enemy):
-        pos = 1 << bit_digit
-        move_mask = 0
-        attack_mask = 0
-
-        left_fence, right_fence = self.get_fence_mask()
-
-        to_up_left = pos
-        while to_up_left & self.get_bits_complement(left_fence):
-            to_up_left >>= self.col + 1
-            if to_up_left & board:
-                if to_up_left & enemy:
-                    attack_mask |= to_up_left
-                break
-            move_mask |= to_up_left
-
-        to_up_right = pos
-        while to_up_right & self.get_bits_complement(right_fence):
-            to_up_right >>= self.col - 1
-            if to_up_right & board:
-                if to_up_right & enemy:
-                    attack_mask |= to_up_right
-                break
-            move_mask |= to_up_right
-
-        to_down_left = pos
-        while to_down_left & self.get_bits_complement(left_fence):
-            to_down_left <<= self.col - 1
-            if to_down_left & board:
-                if to_down_left & enemy:
-                    attack_mask |= to_down_left
-                break
-            move_mask |= to_down_left
-
-        to_down_right = pos
-        while to_down_right & self.get_bits_complement(right_fence):
-            to_down_right <<= self.col + 1
-            if to_down_right & board:
-                if to_down_right & enemy:
-                    attack_mask |= to_down_right
-                break
-            move_mask |= to_down_right
-
-        
-        return move_mask, attack_mask
+        attacks = self.geometry.sliders.bishop_attacks(bit_digit, board)
+        return attacks & ~board, attacks & enemy
 
     def rook_valid_moves(self, bit_digit, board, enemy):
-        move_mask = 0
-        attack_mask = 0
-
-        # Row moves
-        mk, ak = self.row_valid_moves(bit_digit, board, enemy)
-        move_mask |= mk
-        attack_mask |= ak
-        
-        # Col moves
-        mk, ak = self.col_valid_moves(bit_digit, board, enemy)
-        move_mask |= mk
-        attack_mask |= ak
-
-        return (move_mask | attack_mask) & sum(self.board_mask)
+        attacks = self.geometry.sliders.rook_attacks(bit_digit, board)
+        return attacks & ((self.geometry.full_mask ^ board) | enemy)
     
     def bishop_valid_moves(self, bit_digit, board, enemy):
-        move_mask = 0
-        attack_mask = 0
-
-        # Diagonal moves
-        mk, ak = self.diag_valid_moves(bit_digit, board, enemy)
-        move_mask |= mk
-        attack_mask |= ak
-
-        return (move_mask | attack_mask) & sum(self.board_mask)
+        attacks = self.geometry.sliders.bishop_attacks(bit_digit, board)
+        return attacks & ((self.geometry.full_mask ^ board) | enemy)
     
     def queen_valid_moves(self, bit_digit, board, enemy):
-        move_mask = 0
-        attack_mask = 0
-
-        mk, ak = self.row_valid_moves(bit_digit, board, enemy)
-        move_mask |= mk
-        attack_mask |= ak
-
-        mk, ak = self.col_valid_moves(bit_digit, board, enemy)
-        move_mask |= mk
-        attack_mask |= ak
-
-        mk, ak = self.diag_valid_moves(bit_digit, board, enemy)
-        move_mask |= mk
-        attack_mask |= ak
-
-        return (move_mask | attack_mask) & sum(self.board_mask)
\ No newline at end of file
+        attacks = self.geometry.sliders.queen_attacks(bit_digit, board)
+        return attacks & ((self.geometry.full_mask ^ board) | enemy)
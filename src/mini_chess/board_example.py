@@ -4,4 +4,33 @@ GARDNER_BOARD = [
         ".....",
         "PPPPP",
         "RNBQK",
-]
\ No newline at end of file
+]
+
+# 4 columns, 5 rows
+SILVERMAN_BOARD = [
+        "rqkr",
+        "pppp",
+        "....",
+        "PPPP",
+        "RQKR",
+]
+
+LOS_ALAMOS_BOARD = [
+        "rnqknr",
+        "pppppp",
+        "......",
+        "......",
+        "PPPPPP",
+        "RNQKNR",
+]
+
+STANDARD_BOARD = [
+        "rnbqkbnr",
+        "pppppppp",
+        "........",
+        "........",
+        "........",
+        "........",
+        "PPPPPPPP",
+        "RNBQKBNR",
+]
@@ -0,0 +1,82 @@
+"""
+Input planes of MiniChess positions for neural networks, with NumPy.
+
+A position is encoded as PLANES planes of row x col values, squares
+indexed like the board, row 0 being black's back rank:
+
+0-11   pieces on board, one plane per piece code, 1 on their squares
+12     side to move, all 1 when black is to move
+13     clock, the game time on every square
+14-25  pieces in flight, one plane per piece code, the ticks left before
+       the piece lands on its target square
+
+Policy indices are the action indices of batch.py, from_digit * squares
++ to_digit, see index_to_uci and uci_to_index to map them to moves.
+
+NumPy is an optional dependency, pip install mini_chess[numpy].
+"""
+
+from itertools import chain
+
+import numpy as np
+
+from .bit_board import PIECE_SYMBOLS
+from .moves import MAX_SQUARES, encode_move, move_from, move_to
+
+PIECE_PLANES = len(PIECE_SYMBOLS)
+TURN_PLANE = PIECE_PLANES
+CLOCK_PLANE = TURN_PLANE + 1
+FLIGHT_PLANES = CLOCK_PLANE + 1
+PLANES = FLIGHT_PLANES + PIECE_PLANES
+
+
+def planes_shape(games_count, row, col):
+    return games_count, PLANES, row, col
+
+
+def encode_batch(games, out=None, dtype=np.float32):
+    """
+    Write the planes of games of the same size into out, a C-contiguous array of
+    planes_shape(len(games), row, col), allocated when None, and return it
+    """
+    count = len(games)
+    row, col = games[0].row, games[0].col
+    squares = row * col
+    if squares > MAX_SQUARES:
+        raise ValueError(f"Encoding supports up to {MAX_SQUARES} squares")
+    if out is None:
+        out = np.empty(planes_shape(count, row, col), dtype=dtype)
+    elif out.shape != planes_shape(count, row, col) or not out.flags.c_contiguous:
+        raise ValueError(f"out must be a C-contiguous array of shape {planes_shape(count, row, col)}")
+
+    flat = out.reshape(count, PLANES, squares)
+    pieces = np.fromiter(chain.from_iterable(game.pieces for game in games),
+                         dtype=np.uint64, count=count * PIECE_PLANES).reshape(count, PIECE_PLANES, 1)
+    shifts = np.arange(squares, dtype=np.uint64)
+    flat[:, :PIECE_PLANES] = (pieces >> shifts) & np.uint64(1)
+
+    flat[:, TURN_PLANE] = np.fromiter((game._turn for game in games), dtype=dtype, count=count)[:, None]
+    flat[:, CLOCK_PLANE] = np.fromiter((game._time for game in games), dtype=dtype, count=count)[:, None]
+
+    flat[:, FLIGHT_PLANES:] = 0
+    for index, game in enumerate(games):
+        if not game._arrivals:
+            continue
+        planes = flat[index, FLIGHT_PLANES:]
+        # Latest landings first so the earliest one wins on a shared square
+        for time_at in sorted(game._arrivals, reverse=True):
+            for moving_piece in game._arrivals[time_at]:
+                planes[moving_piece.code, moving_piece.to_digit] = time_at - game._time
+    return out
+
+
+def index_to_uci(game, index):
+    """ UCI of a policy index, relative to the side to move of the game """
+    squares = game.row * game.col
+    return game.encoded_to_uci(encode_move(index // squares, index % squares))
+
+
+def uci_to_index(game, uci):
+    """ Policy index of a UCI relative to the side to move of the game """
+    move = game.uci_to_encoded(uci)
+    return move_from(move) * game.row * game.col + move_to(move)
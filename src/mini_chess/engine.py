@@ -0,0 +1,331 @@
+"""
+Alpha-beta search engine over MiniChess.
+
+The search plays its moves on the game itself, a ply being a push of the
+side to move, one update_time and a change of turn as in perft, and undoes
+them with rewind_time and pop. Pieces in flight, their landing order and
+same color collisions are part of the searched state, and the Zobrist key
+identifies them in the transposition table. A side whose pieces are all
+in flight passes.
+
+Search is negamax alpha-beta with iterative deepening, a capture-only
+quiescence search and move ordering by transposition table move, captures
+by most valuable victim, killer moves and history. search() stops on a
+wall-clock or node budget and returns the best move of the deepest
+search, completed or not.
+
+Moves are from_digit * squares + to_digit inside the engine, None for a pass.
+"""
+
+import time
+
+from .bit_board import BLACK_OFFSET, PIECE_VALUES
+from .transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+# Scores are from the side to move, a king capture ply plies ahead scores WIN - ply
+WIN = 1000000
+INFINITY = WIN + 1
+MAX_PLY = 256
+QUIESCENCE_PLIES = 8
+# Nodes between two clock reads
+_CLOCK_INTERVAL = 128
+
+
+def material(game):
+    """ White material minus black material, pieces in flight counted for their color """
+    score = 0
+    for code, bits in enumerate(game.pieces):
+        value = PIECE_VALUES[code % BLACK_OFFSET] * bin(bits).count("1")
+        score += value if code < BLACK_OFFSET else -value
+    for bucket in game._arrivals.values():
+        for moving_piece in bucket:
+            value = PIECE_VALUES[moving_piece.code % BLACK_OFFSET]
+            score += value if moving_piece.code < BLACK_OFFSET else -value
+    return score
+
+
+def incremental(game):
+    """ MiniChess.evaluate, read in O(1) from the evaluator Engine.search attaches while it runs """
+    return game.evaluate()
+
+
+class _BudgetExceeded(Exception):
+    pass
+
+
+class SearchResult:
+    __slots__ = ("move", "score", "depth", "nodes", "seconds")
+
+    def __init__(self, move, score, depth, nodes, seconds):
+        # move: UCI relative to the side to move, None when there's no move to play
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+
+    def __repr__(self):
+        return (f"SearchResult({self.move!r}, score={self.score}, depth={self.depth}, "
+                f"nodes={self.nodes}, seconds={self.seconds:.3f})")
+
+
+class Engine:
+    def __init__(self, tt_size=1 << 16, evaluate=incremental, tablebases=None, tt=None):
+        """
+        evaluate(game) scores a position for white, see incremental and material, and
+        tablebases, e.g. a tablebase.Tablebases, gives the exact value of the positions it holds.
+        tt is a TranspositionTable to share with other engines using the same evaluate, a new one
+        of tt_size entries if None. Keys mix in the move_time of the game, so games of different
+        move times share a table safely.
+        """
+        self.tt = TranspositionTable(tt_size) if tt is None else tt
+        self.evaluate = evaluate
+        self.tablebases = tablebases
+        self._killers = [[None, None] for _ in range(MAX_PLY)]
+        self._history = {}
+        self._game = None
+        self._squares = 0
+        # Zobrist key of the move_time of the searched game
+        self._move_time_key = 0
+        self._nodes = 0
+        self._node_limit = None
+        self._deadline = None
+        self._root_move = None
+        self._root_score = -INFINITY
+
+    def search(self, game, time_limit=None, node_limit=None, max_depth=MAX_PLY - 1):
+        """ Best move of the side to move within time_limit seconds and node_limit nodes, as a SearchResult """
+        # incremental reads an evaluator kept up to date by the plies, attached for the search only
+        attached = self.evaluate is incremental and game._evaluator is None
+        if attached:
+            game.attach_evaluator()
+        try:
+            return self._search(game, time_limit, node_limit, max_depth)
+        finally:
+            if attached:
+                game._evaluator = None
+
+    def _search(self, game, time_limit, node_limit, max_depth):
+        start = time.perf_counter()
+        self._game = game
+        self._squares = game.row * game.col
+        self._move_time_key = game._zobrist.move_time(game._move_time)
+        self._nodes = 0
+        self._node_limit = node_limit
+        self._deadline = None if time_limit is None else start + time_limit
+        self.tt.new_search()
+        self._killers = [[None, None] for _ in range(MAX_PLY)]
+        # Keep some history across searches of a game, as successive positions are alike
+        self._history = {move: score >> 1 for move, score in self._history.items() if score > 1}
+
+        if game.has_winner() is not None:
+            return SearchResult(None, 0, 0, 0, time.perf_counter() - start)
+        moves = self._ordered_moves(0, None)
+        best_move = moves[0]
+        score = 0
+        depth_done = 0
+        for depth in range(1, min(max_depth, MAX_PLY - 1) + 1):
+            self._root_move = None
+            self._root_score = -INFINITY
+            try:
+                score = self._negamax(depth, -INFINITY, INFINITY, 0)
+            except _BudgetExceeded:
+                # The previous best move is searched first, a partial search only improves on it
+                if self._root_move is not None:
+                    best_move = self._root_move
+                    score = self._root_score
+                break
+            best_move = self._root_move
+            depth_done = depth
+            if abs(score) >= WIN - MAX_PLY:
+                break
+        return SearchResult(self._move_to_uci(best_move), score, depth_done, self._nodes,
+                            time.perf_counter() - start)
+
+    def _move_to_uci(self, move):
+        game = self._game
+        if move is None:
+            return None
+        from_x, from_y = game.digit_to_coords(move // self._squares)
+        to_x, to_y = game.digit_to_coords(move % self._squares)
+        if game._turn == 1:
+            from_x, from_y = game.mirror_coords(from_x, from_y)
+            to_x, to_y = game.mirror_coords(to_x, to_y)
+        return game.coords_to_move(from_x, from_y, to_x, to_y)
+
+    def _count_node(self):
+        self._nodes += 1
+        if self._node_limit is not None and self._nodes > self._node_limit:
+            raise _BudgetExceeded
+        if (self._deadline is not None and self._nodes % _CLOCK_INTERVAL == 0
+                and time.perf_counter() >= self._deadline):
+            raise _BudgetExceeded
+
+    def _score(self):
+        # Static score from the side to move
+        score = self.evaluate(self._game)
+        return -score if self._game._turn else score
+
+    def _ordered_moves(self, ply, tt_move, captures_only=False):
+        game = self._game
+        if not game.get_color_bits(game._turn):
+            return [] if captures_only else [None]
+
+        squares = self._squares
+        enemy = game.get_color_bits(1 - game._turn)
+        killers = self._killers[ply]
+        history = self._history
+        scored = []
+        if captures_only:
+            # Only capture masks are built, the full ones are left to the nodes expanding every move
+            sources = game._iter_targets(enemy)
+        else:
+            sources = enumerate(game.legal_targets())
+        for from_digit, mask in sources:
+            if not mask:
+                continue
+            attacker = PIECE_VALUES[game.piece_code_at(from_digit) % BLACK_OFFSET]
+            for to_digit in game.iter_bits(mask):
+                move = from_digit * squares + to_digit
+                if move == tt_move:
+                    order = 1 << 40
+                elif (enemy >> to_digit) & 1:
+                    victim = PIECE_VALUES[game.piece_code_at(to_digit) % BLACK_OFFSET]
+                    order = (1 << 30) + victim * 1024 - attacker
+                elif move == killers[0]:
+                    order = 1 << 29
+                elif move == killers[1]:
+                    order = (1 << 29) - 1
+                else:
+                    order = history.get(move, 0)
+                scored.append((order, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    def _child(self, move, depth, alpha, beta, ply, quiescence=False):
+        # Score of the move for the side to move, searched from the other side
+        game = self._game
+        turn = game._turn
+        if move is not None:
+            game._play(move // self._squares, move % self._squares)
+        game._advance(1)
+        game.cur_color("b" if turn == 0 else "w")
+        try:
+            if quiescence:
+                return -self._quiescence(depth, -beta, -alpha, ply)
+            return -self._negamax(depth, -beta, -alpha, ply)
+        finally:
+            game.cur_color("w" if turn == 0 else "b")
+            game.rewind_time()
+            if move is not None:
+                game.pop()
+
+    def _negamax(self, depth, alpha, beta, ply):
+        self._count_node()
+        game = self._game
+        winner = game.has_winner()
+        if winner is not None:
+            return WIN - ply if winner == game._turn else ply - WIN
+        if ply > 0 and self.tablebases is not None:
+            value = self._probe(ply)
+            if value is not None:
+                return value
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self._quiescence(QUIESCENCE_PLIES, alpha, beta, ply)
+
+        key = game.zobrist_hash() ^ self._move_time_key
+        tt_move = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_depth, bound, value, tt_move = entry
+            value = _value_from_tt(value, ply)
+            if ply > 0 and tt_depth >= depth and (bound == EXACT
+                                                  or (bound == LOWER and value >= beta)
+                                                  or (bound == UPPER and value <= alpha)):
+                return value
+
+        alpha_start = alpha
+        best = -INFINITY
+        best_move = None
+        enemy = game.get_color_bits(1 - game._turn)
+        for move in self._ordered_moves(ply, tt_move):
+            score = self._child(move, depth - 1, alpha, beta, ply + 1)
+            if score > best:
+                best = score
+                best_move = move
+                if ply == 0:
+                    self._root_move = move
+                    self._root_score = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if move is not None and not (enemy >> (move % self._squares)) & 1:
+                    self._remember_quiet(move, depth, ply)
+                break
+
+        if best <= alpha_start:
+            bound = UPPER
+        elif best >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, bound, _value_to_tt(best, ply), best_move)
+        return best
+
+    def _quiescence(self, depth, alpha, beta, ply):
+        self._count_node()
+        game = self._game
+        winner = game.has_winner()
+        if winner is not None:
+            return WIN - ply if winner == game._turn else ply - WIN
+        if self.tablebases is not None:
+            value = self._probe(ply)
+            if value is not None:
+                return value
+
+        stand_pat = self._score()
+        if stand_pat >= beta or depth <= 0 or ply >= MAX_PLY - 1:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        for move in self._ordered_moves(ply, None, captures_only=True):
+            score = self._child(move, depth - 1, alpha, beta, ply + 1, quiescence=True)
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        return alpha
+
+    def _probe(self, ply):
+        # A king capture plies plies ahead, as in the search
+        hit = self.tablebases.probe(self._game)
+        if hit is None:
+            return None
+        result, plies = hit
+        if result == 0:
+            return 0
+        return WIN - ply - plies if result > 0 else ply + plies - WIN
+
+    def _remember_quiet(self, move, depth, ply):
+        killers = self._killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self._history[move] = self._history.get(move, 0) + depth * depth
+
+
+def _value_to_tt(value, ply):
+    # Wins are stored relative to the stored position, not the root
+    if value >= WIN - MAX_PLY:
+        return value + ply
+    if value <= MAX_PLY - WIN:
+        return value - ply
+    return value
+
+
+def _value_from_tt(value, ply):
+    if value >= WIN - MAX_PLY:
+        return value - ply
+    if value <= MAX_PLY - WIN:
+        return value + ply
+    return value
@@ -0,0 +1,117 @@
+"""
+Evaluation of a MiniChess position kept up to date move by move.
+
+An Evaluator attached to a game, see MiniChess.attach_evaluator, is told of
+every piece lifted from or landed on the board and every piece launched
+into or taken out of the air, so MiniChess.evaluate() only reads a sum.
+
+The score is white's minus black's, in centipawns:
+
+material    PIECE_VALUES of the pieces on board and in flight, kings left out
+            as their capture ends the game
+position    piece-square tables of the board size, see piece_square_tables,
+            pieces in flight counted on their target square
+"""
+
+from .bit_board import BLACK_OFFSET, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, PIECE_VALUES
+from .geometry import get_geometry
+
+# Centipawns by piece type
+MATERIAL = tuple(100 * value for value in PIECE_VALUES[:KING]) + (0,)
+# Per move of a piece on an empty board from the square, approximating its mobility
+MOBILITY_WEIGHT = (0, 4, 4, 2, 1, 0)
+# Per row a pawn advanced
+PAWN_ADVANCE = 10
+
+
+def _popcount(bits):
+    return bin(bits).count("1")
+
+
+def _white_table(geometry, kind):
+    row, col = geometry.row, geometry.col
+    sliders = geometry.sliders
+    table = []
+    for sq in range(geometry.squares):
+        if kind == PAWN:
+            # White pawns start on row - 2 and promote on row 0
+            table.append(PAWN_ADVANCE * max(0, row - 2 - sq // col))
+            continue
+        if kind == KNIGHT:
+            moves = geometry.knight_attacks[sq]
+        elif kind == BISHOP:
+            moves = sliders.bishop_attacks(sq, 0)
+        elif kind == ROOK:
+            moves = sliders.rook_attacks(sq, 0)
+        elif kind == QUEEN:
+            moves = sliders.queen_attacks(sq, 0)
+        else:
+            moves = geometry.king_attacks[sq]
+        table.append(MOBILITY_WEIGHT[kind] * _popcount(moves))
+    return tuple(table)
+
+
+_TABLES = {}
+
+
+def piece_square_tables(row, col):
+    """ Bonus of each piece code on each square, [code][bit_digit], black's mirroring white's """
+    tables = _TABLES.get((row, col))
+    if tables is None:
+        geometry = get_geometry(row, col)
+        white = [_white_table(geometry, kind) for kind in range(BLACK_OFFSET)]
+        black = [tuple(table[(row - 1 - sq // col) * col + sq % col] for sq in range(row * col))
+                 for table in white]
+        tables = _TABLES[(row, col)] = tuple(white + black)
+    return tables
+
+
+class Evaluator:
+    __slots__ = ("tables", "material", "position")
+
+    def __init__(self, game):
+        """ Terms of the game computed from scratch, then kept by the game's updates """
+        self.tables = piece_square_tables(game.row, game.col)
+        # Per color, on board and in flight
+        self.material = [0, 0]
+        # White's minus black's
+        self.position = 0
+        for code, bits in enumerate(game.pieces):
+            for bit_digit in game.iter_bits(bits):
+                self.land(bit_digit, code)
+        for bucket in game._arrivals.values():
+            for moving_piece in bucket:
+                self.add_flight(moving_piece)
+
+    def copy(self):
+        other = object.__new__(Evaluator)
+        other.tables = self.tables
+        other.material = self.material[:]
+        other.position = self.position
+        return other
+
+    def score(self):
+        return self.material[0] - self.material[1] + self.position
+
+    def land(self, bit_digit, code):
+        if code < BLACK_OFFSET:
+            self.material[0] += MATERIAL[code]
+            self.position += self.tables[code][bit_digit]
+        else:
+            self.material[1] += MATERIAL[code - BLACK_OFFSET]
+            self.position -= self.tables[code][bit_digit]
+
+    def lift(self, bit_digit, code):
+        if code < BLACK_OFFSET:
+            self.material[0] -= MATERIAL[code]
+            self.position -= self.tables[code][bit_digit]
+        else:
+            self.material[1] -= MATERIAL[code - BLACK_OFFSET]
+            self.position += self.tables[code][bit_digit]
+
+    def add_flight(self, moving_piece):
+        # A piece in the air counts as if it had landed
+        self.land(moving_piece.to_digit, moving_piece.code)
+
+    def remove_flight(self, moving_piece):
+        self.lift(moving_piece.to_digit, moving_piece.code)
@@ -0,0 +1,72 @@
+"""
+Precomputed masks for a board of a given size.
+
+A Geometry only depends on (row, col), so one instance is built per board
+size and shared by every BitBoard of that size through get_geometry().
+Squares use the same bit digits as BitBoard, row 0 being black's back rank.
+Per-color tables are indexed by color, 0 for white (moving towards row 0)
+and 1 for black (moving towards the last row).
+"""
+
+from .sliders import load_slider_tables
+
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+class Geometry:
+    def __init__(self, row, col):
+        self.row = row
+        self.col = col
+        self.squares = row * col
+        self.board_mask = tuple(((1 << col) - 1) << (y * col) for y in range(row))
+        self.full_mask = (1 << self.squares) - 1
+
+        self.left_fence = 0
+        self.right_fence = 0
+        for y in range(row):
+            self.left_fence |= 1 << (y * col)
+            self.right_fence |= 1 << (y * col + col - 1)
+
+        self.knight_attacks = tuple(self._step_mask(sq, KNIGHT_STEPS) for sq in range(self.squares))
+        self.king_attacks = tuple(self._step_mask(sq, KING_STEPS) for sq in range(self.squares))
+
+        # Pawns of either color, forward being -1 row for white and +1 row for black
+        self.pawn_pushes = (self._pawn_pushes(-1), self._pawn_pushes(1))
+        self.pawn_double_pushes = (self._pawn_double_pushes(-1, row - 2),
+                                   self._pawn_double_pushes(1, 1))
+        self.pawn_attacks = (self._pawn_attacks(-1), self._pawn_attacks(1))
+
+        # Rook, bishop and queen attacks indexed by occupancy
+        self.sliders = load_slider_tables(row, col)
+
+    def _step_mask(self, sq, steps):
+        x, y = sq % self.col, sq // self.col
+        mask = 0
+        for dy, dx in steps:
+            to_x, to_y = x + dx, y + dy
+            if 0 <= to_x < self.col and 0 <= to_y < self.row:
+                mask |= 1 << (to_y * self.col + to_x)
+        return mask
+
+    def _pawn_pushes(self, forward):
+        return tuple(self._step_mask(sq, ((forward, 0),)) for sq in range(self.squares))
+
+    def _pawn_double_pushes(self, forward, start_y):
+        # Two steps forward when at its default position
+        return tuple(self._step_mask(sq, ((forward * 2, 0),)) if sq // self.col == start_y else 0
+                     for sq in range(self.squares))
+
+    def _pawn_attacks(self, forward):
+        return tuple(self._step_mask(sq, ((forward, -1), (forward, 1))) for sq in range(self.squares))
+
+
+_GEOMETRIES = {}
+
+
+def get_geometry(row, col):
+    """ Shared Geometry of a row x col board """
+    geometry = _GEOMETRIES.get((row, col))
+    if geometry is None:
+        geometry = _GEOMETRIES[(row, col)] = Geometry(row, col)
+    return geometry
@@ -0,0 +1,238 @@
+"""
+Monte Carlo tree search with PUCT over MiniChess.
+
+A ply is played as in perft and engine.py: a push of the side to move,
+one update_time and a change of turn, a pass when every piece of the side
+is in flight. Playouts walk the tree on the searched game itself and undo
+their plies, only the leaves are cloned, to be handed to the evaluator.
+
+Playouts are collected batch_size at a time, each one adding a virtual
+loss along its path so the next ones spread over other leaves, then the
+evaluator scores all their leaves in one call:
+
+    evaluate(games) -> [(priors, value), ...]
+
+priors is indexed by the policy index of a move, from_digit * squares +
+to_digit as in batch.py and encoding.py, e.g. a row of a NumPy policy
+output, or None for uniform priors. Priors are renormalized over the legal
+moves. value is the expected outcome in [-1, 1] for the side to move.
+
+The tree is kept between searches. A search starts from the node of the
+current position when it's the root or a descendant within two plies,
+found by Zobrist key, so successive push/update_time calls reuse the
+subtree explored below the moves played.
+"""
+
+import math
+import sys
+import time
+
+# Visits added to, and wins taken from, each node of a pending playout
+VIRTUAL_LOSS = 1
+# Plies below the root searched for the current position on tree reuse
+REUSE_PLIES = 2
+
+
+def static_evaluator(games):
+    """ Uniform priors and MiniChess.evaluate of the side to move squashed to [-1, 1] """
+    results = []
+    for game in games:
+        score = game.evaluate()
+        results.append((None, math.tanh((-score if game._turn else score) / 400)))
+    return results
+
+
+class Node:
+    __slots__ = ("move", "prior", "visits", "value_sum", "children", "key")
+
+    def __init__(self, move, prior):
+        # move: policy index played to reach the node, None for a pass
+        self.move = move
+        self.prior = prior
+        self.visits = 0
+        # Sum of the outcomes for the side that played move
+        self.value_sum = 0.0
+        # None until expanded, () once known to end the game
+        self.children = None
+        self.key = None
+
+
+class MCTS:
+    def __init__(self, evaluate=static_evaluator, c_puct=1.5, batch_size=8):
+        self.evaluate = evaluate
+        self.c_puct = c_puct
+        self.batch_size = batch_size
+        self.root = None
+        self._squares = 0
+        self.playouts = 0
+        self.seconds = 0.0
+
+    def search(self, game, playouts=800, time_limit=None):
+        """ Run playouts from the position of the game, or until time_limit seconds, return the root """
+        start = time.perf_counter()
+        deadline = None if time_limit is None else start + time_limit
+        self._squares = game.row * game.col
+        self._reuse(game.zobrist_hash())
+        # Leaves are clones of the game, which copy its evaluator rather than build one each
+        attached = self.evaluate is static_evaluator and game._evaluator is None
+        if attached:
+            game.attach_evaluator()
+
+        done = 0
+        try:
+            while done < playouts and (deadline is None or time.perf_counter() < deadline):
+                done += self._run_batch(game, min(self.batch_size, playouts - done))
+        finally:
+            if attached:
+                game._evaluator = None
+        self.playouts += done
+        self.seconds += time.perf_counter() - start
+        return self.root
+
+    def best_move(self, game):
+        """ UCI of the most visited move at the root, None without a move """
+        if not self.root or not self.root.children:
+            return None
+        child = max(self.root.children, key=lambda child: child.visits)
+        return self._move_to_uci(game, child.move)
+
+    def visit_counts(self, game):
+        """ {uci: visits} of the moves at the root, a training target for the policy """
+        if not self.root or not self.root.children:
+            return {}
+        return {self._move_to_uci(game, child.move): child.visits for child in self.root.children}
+
+    def stats(self):
+        """ Playouts per second over all searches, and the size of the current tree """
+        nodes = 0
+        size = 0
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            size += sys.getsizeof(node)
+            if node.children:
+                size += sys.getsizeof(node.children)
+                stack.extend(node.children)
+        return {"playouts": self.playouts, "seconds": self.seconds,
+                "playouts_per_sec": self.playouts / self.seconds if self.seconds else 0.0,
+                "nodes": nodes, "bytes_per_node": size / nodes if nodes else 0.0}
+
+    def _reuse(self, key):
+        # Keep the subtree of the position, breadth first as the root itself is the likeliest
+        level = [self.root] if self.root else []
+        for _ in range(REUSE_PLIES + 1):
+            for node in level:
+                if node.key == key:
+                    self.root = node
+                    return
+            level = [child for node in level if node.children for child in node.children]
+        self.root = Node(None, 1.0)
+
+    def _move_to_uci(self, game, move):
+        if move is None:
+            return None
+        from_x, from_y = game.digit_to_coords(move // self._squares)
+        to_x, to_y = game.digit_to_coords(move % self._squares)
+        if game._turn == 1:
+            from_x, from_y = game.mirror_coords(from_x, from_y)
+            to_x, to_y = game.mirror_coords(to_x, to_y)
+        return game.coords_to_move(from_x, from_y, to_x, to_y)
+
+    def _play(self, game, move):
+        turn = game._turn
+        if move is not None:
+            game._play(move // self._squares, move % self._squares)
+        game._advance(1)
+        game.cur_color("b" if turn == 0 else "w")
+
+    def _undo(self, game, move):
+        game.cur_color("b" if game._turn == 0 else "w")
+        game.rewind_time()
+        if move is not None:
+            game.pop()
+
+    def _select(self, node):
+        # PUCT, unvisited children valued as losses
+        sqrt_visits = math.sqrt(node.visits)
+        c_puct = self.c_puct
+        best = None
+        best_score = -math.inf
+        for child in node.children:
+            if child.visits:
+                q = child.value_sum / child.visits
+            else:
+                q = -1.0
+            score = q + c_puct * child.prior * sqrt_visits / (1 + child.visits)
+            if score > best_score:
+                best_score = score
+                best = child
+        return best
+
+    def _run_batch(self, game, size):
+        # Collect up to size playouts under virtual loss, evaluate their leaves at once, back them up
+        pending = []
+        played = 0
+        for _ in range(size):
+            node = self.root
+            path = [node]
+            while node.children:
+                node = self._select(node)
+                self._play(game, node.move)
+                path.append(node)
+
+            winner = game.has_winner()
+            if winner is not None:
+                # Same color collisions may capture the king of the side that moved
+                node.children = ()
+                self._backup(path, 1.0 if winner == game._turn else -1.0)
+                played += 1
+            elif any(leaf is node for leaf, _, _ in pending):
+                # Taken by a pending playout, evaluate what's collected first
+                self._rewind(game, path)
+                break
+            else:
+                node.key = game.zobrist_hash()
+                for visited in path:
+                    visited.visits += VIRTUAL_LOSS
+                    visited.value_sum -= VIRTUAL_LOSS
+                pending.append((node, path, game.clone()))
+            self._rewind(game, path)
+
+        if pending:
+            results = self.evaluate([leaf_game for _, _, leaf_game in pending])
+            for (node, path, leaf_game), (priors, value) in zip(pending, results):
+                for visited in path:
+                    visited.visits -= VIRTUAL_LOSS
+                    visited.value_sum += VIRTUAL_LOSS
+                self._expand(node, leaf_game, priors)
+                self._backup(path, value)
+            played += len(pending)
+        return played
+
+    def _rewind(self, game, path):
+        for node in reversed(path[1:]):
+            self._undo(game, node.move)
+
+    def _expand(self, node, game, priors):
+        if not game.get_color_bits(game._turn):
+            node.children = [Node(None, 1.0)]
+            return
+
+        squares = self._squares
+        moves = [from_digit * squares + to_digit
+                 for from_digit, mask in enumerate(game.legal_targets())
+                 for to_digit in game.iter_bits(mask)]
+        weights = [1.0] * len(moves) if priors is None else [float(priors[move]) for move in moves]
+        total = sum(weights)
+        if total <= 0:
+            weights = [1.0] * len(moves)
+            total = len(moves)
+        node.children = [Node(move, weight / total) for move, weight in zip(moves, weights)]
+
+    def _backup(self, path, value):
+        # value is for the side to move at the leaf, the node above it played against it
+        for node in reversed(path):
+            value = -value
+            node.visits += 1
+            node.value_sum += value
@@ -1,30 +1,171 @@
-import copy
+from .bit_board import BitBoard, PIECE_SYMBOLS, BLACK_OFFSET, PAWN, QUEEN, KING
+from .zobrist import get_zobrist_keys
+from .evaluation import Evaluator
+from .moves import (MAX_SQUARES, FLAG_STAY, FLAG_CAPTURE, FLAG_PROMOTION,
+                    encode_move, move_from, move_to)
+from array import array
+from heapq import heappush, heappop, heapify
 
-from .bit_board import BitBoard
-from collections import deque
+# Kinds of undo entries
+_PUSH = 0
+_TICK = 1
+# Shared entries of pushes staying and ticks landing nothing, the bulk of long real-time games
+_STAY_ENTRY = (_PUSH, None)
+_IDLE_TICK_ENTRY = (_TICK, 1, ())
+
+# Starting positions by board rows, copied by reset, and how many are kept
+_STARTS = {}
+MAX_STARTS = 64
+
+class MovingPiece:
+    """ A piece in flight, launched by push and landing on update_time """
+    __slots__ = ("code", "from_digit", "to_digit", "time_at")
+
+    def __init__(self, code, from_digit, to_digit, time_at):
+        self.code = code
+        self.from_digit = from_digit
+        self.to_digit = to_digit
+        self.time_at = time_at
+
+    def __repr__(self):
+        return f"MovingPiece({PIECE_SYMBOLS[self.code]!r}, {self.from_digit}, {self.to_digit}, {self.time_at})"
 
 class MiniChess(BitBoard):
-    def __init__(self, board, move_time = 1):
+    __slots__ = ("_zobrist", "_board_hash", "_flight_hash", "_turn", "_rendered", "_legal_targets",
+                 "_arrivals", "_arrival_times", "_move_time", "_time", "_undo", "keep_undo",
+                 "_kings_in_flight", "_game_end_listeners", "_game_ended", "_evaluator")
+
+    def __init__(self, board, move_time = 1, keep_undo=False):
+        self._zobrist = get_zobrist_keys(len(board) * len(board[0]))
+        # Zobrist key of the pieces on board and the turn, pieces in flight are in _flight_hash
+        self._board_hash = 0
+        self._flight_hash = 0
         super().__init__(board)
+        for code, bits in enumerate(self.pieces):
+            for bit_digit in self.iter_bits(bits):
+                self._board_hash ^= self._zobrist.pieces[code][bit_digit]
         
         self._turn = 0
-        # Initialize the board with starting positions
-        self._board = board
-        # Moving queue for pieces
-        self._moving_queue = deque()
+        # Rows of piece symbols, rendered from the bitboards on demand
+        self._rendered = None
+        # Legal destination mask per from-digit for the side to move, built on demand
+        self._legal_targets = None
+        # Pieces in flight bucketed by landing time, in push order, and a heap of the bucket times
+        self._arrivals = {}
+        self._arrival_times = []
         self._move_time = move_time
         self._time = 0
+        # Undo entries, see pop and rewind_time. The plies of perft and searches are always
+        # recorded, push and update_time only with keep_undo so games played on don't grow it
+        self._undo = []
+        self.keep_undo = keep_undo
+        # Kings in flight per color and callbacks of add_game_end_listener, None until one is added
+        self._kings_in_flight = [0, 0]
+        self._game_end_listeners = None
+        # Set once the listeners were told of the winner, so they are called once per game
+        self._game_ended = False
+        # Evaluator kept up to date by lift, land and the flight schedule, see attach_evaluator
+        self._evaluator = None
+
+    def reset(self, board, move_time=None):
+        """ Start a new game on board in place, keeping move_time unless given and the game end listeners """
+        # Copy the parsed starting position of the board rather than parse it again
+        key = tuple(board)
+        start = _STARTS.get(key)
+        if start is None:
+            if len(_STARTS) >= MAX_STARTS:
+                _STARTS.clear()
+            start = _STARTS[key] = MiniChess(board)
+        listeners = self._game_end_listeners
+        evaluated = self._evaluator is not None
+        move_time = self._move_time if move_time is None else move_time
+        keep_undo = self.keep_undo
+        start._copy_into(self)
+        self._move_time = move_time
+        self.keep_undo = keep_undo
+        self._game_end_listeners = listeners
+        # The cached start stays without an evaluator, copied into every game reset from it
+        self._evaluator = Evaluator(self) if evaluated else None
+
+    def attach_evaluator(self):
+        """ Keep an Evaluator of the position up to date from now on, see evaluation.py """
+        self._evaluator = Evaluator(self)
+        return self._evaluator
+
+    def evaluate(self):
+        """ White's score minus black's in centipawns, attaching an evaluator on first use """
+        if self._evaluator is None:
+            self.attach_evaluator()
+        return self._evaluator.score()
+
+    def clone(self):
+        """ Copy of the position sharing the tables of the board size, without the undo history and listeners """
+        other = object.__new__(type(self))
+        self._copy_into(other)
+        return other
+
+    def _copy_into(self, other):
+        other.col = self.col
+        other.row = self.row
+        other.geometry = self.geometry
+        other.board_mask = self.board_mask
+        other.white_pieces = self.white_pieces
+        other.black_pieces = self.black_pieces
+        other.pieces = self.pieces[:]
+        other._zobrist = self._zobrist
+        other._board_hash = self._board_hash
+        other._flight_hash = self._flight_hash
+        other._turn = self._turn
+        # Both caches are replaced on change, never updated in place
+        other._rendered = self._rendered
+        other._legal_targets = self._legal_targets
+        # Pieces in flight don't change once launched and are shared
+        other._arrivals = {time_at: bucket[:] for time_at, bucket in self._arrivals.items()}
+        other._arrival_times = self._arrival_times[:]
+        other._move_time = self._move_time
+        other._time = self._time
+        other._undo = []
+        other.keep_undo = self.keep_undo
+        other._kings_in_flight = self._kings_in_flight[:]
+        other._game_end_listeners = None
+        other._game_ended = self._game_ended
+        other._evaluator = None if self._evaluator is None else self._evaluator.copy()
 
     def __str__(self):
         # Convert the board to a printable string
         return "\n".join(self._board)
+
+    @property
+    def _moving_queue(self):
+        # Pieces in flight in landing order
+        return [moving_piece for time_at in sorted(self._arrivals)
+                for moving_piece in self._arrivals[time_at]]
+
+    @property
+    def _board(self):
+        if self._rendered is None:
+            cells = ["."] * (self.row * self.col)
+            for code, bits in enumerate(self.pieces):
+                for bit_digit in self.iter_bits(bits):
+                    cells[bit_digit] = PIECE_SYMBOLS[code]
+            self._rendered = ["".join(cells[y * self.col:(y + 1) * self.col]) for y in range(self.row)]
+        return self._rendered
     
     def cur_color(self, color):
         """ Input "w" for white, "b" for black """
+        turn = self._turn
         if color == "w":
-            self._turn = 0
+            turn = 0
         elif color == "b":
-            self._turn = 1
+            turn = 1
+        if turn != self._turn:
+            self._turn = turn
+            self._legal_targets = None
+            self._board_hash ^= self._zobrist.turn
+
+    def zobrist_hash(self):
+        """ 64-bit key of the board, turn and pieces in flight, see zobrist.py """
+        return self._board_hash ^ self._flight_hash
 
     def mirror_coords(self, x, y):
         return x, self.row - (y + 1) 
@@ -47,41 +188,85 @@ class MiniChess(BitBoard):
 
         return from_col + from_row + to_col + to_row
 
+    def encoded_to_uci(self, move):
+        """ UCI of an encoded move, relative to the side to move """
+        from_x, from_y = self.digit_to_coords(move_from(move))
+        to_x, to_y = self.digit_to_coords(move_to(move))
+        if self._turn == 1:
+            from_x, from_y = self.mirror_coords(from_x, from_y)
+            to_x, to_y = self.mirror_coords(to_x, to_y)
+
+        return self.coords_to_move(from_x, from_y, to_x, to_y)
+
+    def uci_to_encoded(self, move):
+        """ Encoded move of a UCI relative to the side to move, flags left out """
+        from_x, from_y, to_x, to_y = self.move_to_coords(move)
+        if self._turn == 1:
+            from_x, from_y = self.mirror_coords(from_x, from_y)
+            to_x, to_y = self.mirror_coords(to_x, to_y)
+
+        return encode_move(from_y * self.col + from_x, to_y * self.col + to_x)
+
+    def legal_targets(self):
+        """ Destination masks indexed by from-digit for the side to move, cached until the position changes """
+        if self._legal_targets is None:
+            targets = [0] * (self.row * self.col)
+            offset = self._turn * BLACK_OFFSET
+            for code in range(offset, offset + BLACK_OFFSET):
+                for from_digit in self.iter_bits(self.pieces[code]):
+                    # Make staling a valid move
+                    targets[from_digit] = self.piece_targets(from_digit, code) | (1 << from_digit)
+            self._legal_targets = targets
+        return self._legal_targets
+
+    def is_legal_digits(self, from_digit, to_digit):
+        # Check if moving from a bit digit to another is legal, without building every mask
+        if self._legal_targets is not None:
+            return bool((self._legal_targets[from_digit] >> to_digit) & 1)
+        if not (self.get_color_bits(self._turn) >> from_digit) & 1:
+            return False
+        if from_digit == to_digit:
+            return True
+        return bool((self.piece_targets(from_digit, self.piece_code_at(from_digit)) >> to_digit) & 1)
+
     def is_legal_move(self, move):
         # Check if the given move is legal
-        if move not in self.generate_all_moves():
-            print("Invalid move!")
+        try:
+            from_x, from_y, to_x, to_y = self.move_to_coords(move)
+        except (ValueError, IndexError, TypeError):
             return False
+        if len(move) != 4 or not (0 <= from_x < self.col and 0 <= to_x < self.col
+                                  and 0 <= from_y < self.row and 0 <= to_y < self.row):
+            return False
+        if self._turn == 1:
+            from_x, from_y = self.mirror_coords(from_x, from_y)
+            to_x, to_y = self.mirror_coords(to_x, to_y)
         # if self.leaves_king_in_check(move):
-        #     print("King in check!")
         #     return False
-        return True
+        return self.is_legal_digits(from_y * self.col + from_x, to_y * self.col + to_x)
 
     def has_winner(self):
         # Return a winner 0/1 if k/K is captured, otherwise, return None
-        # If K and k are still alive
-        K_n_k = [False, False]
-
-        # Check on flying pieces
-        for piece in self._moving_queue:
-            if piece["piece"] == "K":
-                K_n_k[0] = True
-            elif piece["piece"] == "k":
-                K_n_k[1] = True
-        # Check on board
-        for from_y in range(self.row):
-            for from_x in range(self.col):
-                piece = self._board[from_y][from_x]
-                if piece == "K":
-                    K_n_k[0] = True
-                elif piece == "k":
-                    K_n_k[1] = True
-            
-        if not K_n_k[0]:
+        # A king is alive on board or in flight
+        if not (self.pieces[KING] or self._kings_in_flight[0]):
             return 1
-        if not K_n_k[1]:
+        if not (self.pieces[BLACK_OFFSET + KING] or self._kings_in_flight[1]):
             return 0
         return None
+
+    def add_game_end_listener(self, callback):
+        """
+        Call callback(game, winner) once when a landing of update_time or advance captures a king
+        and ends the game, the plies searched and undone by perft, the engine or MCTS never call it
+        """
+        if self._game_end_listeners is None:
+            self._game_end_listeners = []
+        self._game_end_listeners.append(callback)
+
+    def remove_game_end_listener(self, callback):
+        self._game_end_listeners.remove(callback)
+        if not self._game_end_listeners:
+            self._game_end_listeners = None
     
     def parse_move(self, move):
         # Convert the move to board coordinates
@@ -90,131 +275,274 @@ class MiniChess(BitBoard):
             from_x, from_y = self.mirror_coords(from_x, from_y)
             to_x, to_y = self.mirror_coords(to_x, to_y)
         
-        piece = self._board[from_y][from_x]
+        code = self.piece_code_at(from_y * self.col + from_x)
+        piece = "." if code is None else PIECE_SYMBOLS[code]
         
         return piece, (from_x, from_y), (to_x, to_y)
     
-    def piece_up(self, from_x, from_y):
-        # Update bitboard
-        super().piece_up(from_x, from_y)
-        
-        # Take the piece from the board
-        self._board[from_y] = (
-            self._board[from_y][:from_x]
-            + "."
-            + self._board[from_y][from_x + 1 :]
-        )
+    def lift(self, bit_digit):
+        # Update bitboard, every piece_up and piece_down goes through lift
+        code = super().lift(bit_digit)
+        if code is not None:
+            self._board_hash ^= self._zobrist.pieces[code][bit_digit]
+            self._rendered = None
+            self._legal_targets = None
+            if self._evaluator is not None:
+                self._evaluator.lift(bit_digit, code)
+        return code
+
+    def land(self, bit_digit, code):
+        captured = super().land(bit_digit, code)
+        self._board_hash ^= self._zobrist.pieces[code][bit_digit]
+        self._rendered = None
+        self._legal_targets = None
+        if self._evaluator is not None:
+            self._evaluator.land(bit_digit, code)
+        return captured
         
     def piece_down(self, to_x, to_y, piece, is_white):
         # Update bitboard
-        super().piece_down(to_x, to_y, is_white)
-        
-        # Make the move on the board
-        self._board[to_y] = (
-            self._board[to_y][:to_x]
-            + piece
-            + self._board[to_y][to_x + 1 :]
-        )
+        captured = super().piece_down(to_x, to_y, piece, is_white)
         self.check_queen_promotion(to_x, to_y)
+        return captured
     
     def push(self, move):
         if not self.is_legal_move(move):
             return False
         
-        if move[:2] != move[2:]:        
-            piece, from_coord, to_coord = self.parse_move(move)
-            moving_piece = {"color": self._turn,
-                            "from_coord": from_coord,
-                            "to_coord": to_coord,
-                            "piece": piece,
-                            "time_at": self._time + self._move_time}
-            
-            self.piece_up(from_coord[0], from_coord[1])
-            self._moving_queue.append(moving_piece)
+        _, (from_x, from_y), (to_x, to_y) = self.parse_move(move)
+        self._push_digits(from_y * self.col + from_x, to_y * self.col + to_x)
             
         return True
+
+    def push_encoded(self, move):
+        """ push() taking an encoded move, its flags are ignored """
+        from_digit = move_from(move)
+        to_digit = move_to(move)
+        if from_digit >= self.row * self.col or not self.is_legal_digits(from_digit, to_digit):
+            return False
+
+        self._push_digits(from_digit, to_digit)
+        return True
+
+    def _push_digits(self, from_digit, to_digit):
+        # Push a move known to be legal, recorded for pop with keep_undo only
+        entry = self._launch(from_digit, to_digit) if from_digit != to_digit else _STAY_ENTRY
+        if self.keep_undo:
+            self._undo.append(entry)
+
+    def _play(self, from_digit, to_digit):
+        # Push a move known to be legal, always recorded, for the plies of perft and searches
+        self._undo.append(self._launch(from_digit, to_digit) if from_digit != to_digit else _STAY_ENTRY)
+
+    def _launch(self, from_digit, to_digit):
+        # Take the piece off the board until it lands on update_time
+        code = self.lift(from_digit)
+        moving_piece = MovingPiece(code, from_digit, to_digit, self._time + self._move_time)
+        if code % BLACK_OFFSET == KING:
+            self._kings_in_flight[code // BLACK_OFFSET] += 1
+        self._schedule(moving_piece, False)
+        self._flight_hash ^= self._flight_key(moving_piece)
+        return _PUSH, moving_piece
+
+    def _schedule(self, moving_piece, first):
+        # Put a piece in flight last, or first when rewinding, among the ones landing on the same tick
+        if self._evaluator is not None:
+            self._evaluator.add_flight(moving_piece)
+        time_at = moving_piece.time_at
+        bucket = self._arrivals.get(time_at)
+        if bucket is None:
+            self._arrivals[time_at] = [moving_piece]
+            heappush(self._arrival_times, time_at)
+        elif first:
+            bucket.insert(0, moving_piece)
+        else:
+            bucket.append(moving_piece)
+
+    def _flight_key(self, moving_piece):
+        # Zobrist key of a piece in flight, by ticks left until it lands
+        table = self._zobrist.in_flight(moving_piece.time_at - self._time)
+        return table[moving_piece.code][moving_piece.to_digit]
+
+    def _rehash_flight(self):
+        # Ticks left change for every piece in flight when the clock moves
+        flight_hash = 0
+        for bucket in self._arrivals.values():
+            for moving_piece in bucket:
+                flight_hash ^= self._flight_key(moving_piece)
+        self._flight_hash = flight_hash
+
+    def pop(self):
+        """ Undo the last push, which must be the last change since update_time, see keep_undo """
+        if not self._undo or self._undo[-1][0] != _PUSH:
+            raise IndexError("The last change is not a recorded push")
+        moving_piece = self._undo.pop()[1]
+        if moving_piece is None:
+            return
+
+        # The piece is the last one of its bucket as later changes were undone already
+        self._flight_hash ^= self._flight_key(moving_piece)
+        time_at = moving_piece.time_at
+        bucket = self._arrivals[time_at]
+        bucket.pop()
+        if not bucket:
+            del self._arrivals[time_at]
+            self._arrival_times.remove(time_at)
+            heapify(self._arrival_times)
+        if moving_piece.code % BLACK_OFFSET == KING:
+            self._kings_in_flight[moving_piece.code // BLACK_OFFSET] -= 1
+        if self._evaluator is not None:
+            self._evaluator.remove_flight(moving_piece)
+        self.land(moving_piece.from_digit, moving_piece.code)
+
+    def next_arrival(self):
+        """ Time of the next landing, None if nothing is in flight """
+        return self._arrival_times[0] if self._arrival_times else None
         
     def update_time(self):
-        self._time += 1
-        if len(self._moving_queue) != 0 and self._moving_queue[0]["time_at"] == self._time:
-            moving_piece = self._moving_queue.popleft()
-            is_white = True if moving_piece["color"] == 0 else False
-            from_x, from_y = moving_piece["from_coord"]
-            to_x, to_y = moving_piece["to_coord"]
-            piece = moving_piece["piece"]
-            
-            self.piece_down(to_x, to_y, piece, is_white)
-            
-            if not is_white:
-                from_x, from_y = self.mirror_coords(from_x, from_y)
-                to_x, to_y = self.mirror_coords(to_x, to_y)
-            
-            uci = self.coords_to_move(from_x, from_y, to_x, to_y)
-            return (uci, moving_piece["piece"])
+        """ Move the clock by one tick, return the landed pieces as a list of (uci, piece) """
+        return self.advance(1)
+
+    def advance(self, ticks):
+        """
+        Move the clock by ticks at once, landing every due piece by time then push order,
+        return the landed pieces as update_time. rewind_time undoes the whole jump.
+        """
+        arrivals, entry = self._tick(ticks)
+        if self.keep_undo:
+            self._undo.append(entry)
+        if arrivals and self._game_end_listeners is not None and not self._game_ended:
+            winner = self.has_winner()
+            if winner is not None:
+                self._game_ended = True
+                for callback in list(self._game_end_listeners):
+                    callback(self, winner)
+        return arrivals
+
+    def advance_to_next_event(self):
+        """ Jump the clock to the next landing, return the landed pieces as update_time """
+        if not self._arrival_times:
+            return []
+        return self.advance(self._arrival_times[0] - self._time)
+
+    def _advance(self, ticks):
+        # advance of the plies made and unmade by searches, always recorded, game end listeners aren't called
+        arrivals, entry = self._tick(ticks)
+        self._undo.append(entry)
+        return arrivals
+
+    def _tick(self, ticks):
+        # Move the clock, return the arrivals and the undo entry of the jump
+        if ticks < 0:
+            raise ValueError("The clock can't go backwards, use rewind_time")
+        end_time = self._time + ticks
+        arrival_times = self._arrival_times
+        landed = []
+        arrivals = []
+        while arrival_times and arrival_times[0] <= end_time:
+            time_at = heappop(arrival_times)
+            self._time = time_at
+            for moving_piece in self._arrivals.pop(time_at):
+                from_x, from_y = self.digit_to_coords(moving_piece.from_digit)
+                to_x, to_y = self.digit_to_coords(moving_piece.to_digit)
+                piece = PIECE_SYMBOLS[moving_piece.code]
+                if self._evaluator is not None:
+                    self._evaluator.remove_flight(moving_piece)
+
+                captured = self.land(moving_piece.to_digit, moving_piece.code)
+                self.check_queen_promotion(to_x, to_y)
+                landed.append((moving_piece, captured))
+                if moving_piece.code % BLACK_OFFSET == KING:
+                    self._kings_in_flight[moving_piece.code // BLACK_OFFSET] -= 1
+
+                if moving_piece.code >= BLACK_OFFSET:
+                    from_x, from_y = self.mirror_coords(from_x, from_y)
+                    to_x, to_y = self.mirror_coords(to_x, to_y)
+
+                uci = self.coords_to_move(from_x, from_y, to_x, to_y)
+                arrivals.append((uci, piece))
+        self._time = end_time
+
+        if self._arrivals:
+            self._rehash_flight()
         else:
-            return None
+            self._flight_hash = 0
+        if landed or ticks != 1:
+            return arrivals, (_TICK, ticks, landed)
+        return arrivals, _IDLE_TICK_ENTRY
+
+    def rewind_time(self):
+        """ Undo the last update_time or advance, which must be the last change since push, see keep_undo """
+        if not self._undo or self._undo[-1][0] != _TICK:
+            raise IndexError("The last change is not a recorded update_time")
+        _, ticks, landed = self._undo.pop()
+        self._time -= ticks
+
+        # Take the landed pieces, promoted or not, back into the air
+        for moving_piece, captured in reversed(landed):
+            to_digit = moving_piece.to_digit
+            self.lift(to_digit)
+            if captured is not None:
+                self.land(to_digit, captured)
+            if moving_piece.code % BLACK_OFFSET == KING:
+                self._kings_in_flight[moving_piece.code // BLACK_OFFSET] += 1
+            self._schedule(moving_piece, True)
+        if self._arrivals:
+            self._rehash_flight()
+        if self._game_ended and self.has_winner() is None:
+            # The game goes on again, its end will be told again
+            self._game_ended = False
+
+    def clear_undo(self):
+        """ Forget the undo entries, e.g. those kept with keep_undo """
+        self._undo.clear()
     
     def check_queen_promotion(self, x, y):
-        if y == 0:
-            if self._board[y][x] == "P":
-                self._board[y] = (
-                    self._board[y][:x]
-                    + "Q"
-                    + self._board[y][x + 1 :]
-                )
-        if y == 4:
-            if self._board[y][x] == "p":
-                self._board[y] = (
-                    self._board[y][:x]
-                    + "q"
-                    + self._board[y][x + 1 :]
-                )
+        bit_digit = y * self.col + x
+        bit = 1 << bit_digit
+        if y == 0 and self.pieces[PAWN] & bit:
+            self.land(bit_digit, QUEEN)
+        if y == self.row - 1 and self.pieces[BLACK_OFFSET + PAWN] & bit:
+            self.land(bit_digit, BLACK_OFFSET + QUEEN)
 
     def get_king(self, color):
         """ Input 0 for white, 1 for black """
-        king = "K" if color == 0 else "k"
+        kings = self.pieces[color * BLACK_OFFSET + KING]
 
         # Find the king of the given color
-        for from_y in range(self.row):
-            for from_x in range(self.col):
-                piece = self._board[from_y][from_x]
-                if piece == king:
-                    return from_x, from_y
+        if kings:
+            return self.digit_to_coords((kings & -kings).bit_length() - 1)
         
         assert True, "There's no king on the board."
 
     def is_in_check(self, color):
         """ Input 0 for white, 1 for black """
-        # Check if the current player is in check
-        king_x, king_y = self.get_king(color)
-
-        # Get the opponent's valid moves
-        self.cur_color("b" if color == 0 else "w")
-        valid_moves = set(self.generate_all_moves())
-
-        # Convert king's pos to black's relative pos if the opponent is black
-        if self._turn == 1:
-            king_x, king_y = self.mirror_coords(king_x, king_y)
-
-        for y in range(self.row):
-            for x in range(self.col):
-                from_x = x
-                from_y = y
-                if self._turn == 1:
-                    from_x, from_y = self.mirror_coords(from_x, from_y)
-
-                move = self.coords_to_move(from_x, from_y, king_x, king_y)
-
-                if move in valid_moves:
-                    return True
+        # Check if the king of the color is attacked by any opponent piece
+        kings = self.pieces[color * BLACK_OFFSET + KING]
+        for bit_digit in self.iter_bits(kings):
+            if self.attackers_to(bit_digit, 1 - color):
+                return True
         return False
 
     def leaves_king_in_check(self, move):
-        # Check if the move leaves the current player's king in check
-        temp_board = copy.deepcopy(self)
-        temp_board.make_move(move)
+        # Check if the move leaves the current player's king in check one tick later,
+        # when a delayed piece may still be on its way
+        if not self.is_legal_move(move):
+            return False
+        _, (from_x, from_y), (to_x, to_y) = self.parse_move(move)
+        self._play(from_y * self.col + from_x, to_y * self.col + to_x)
+        self._advance(1)
+        in_check = self.is_in_check(self._turn)
+        self.rewind_time()
+        self.pop()
+
+        return in_check
 
-        return temp_board.is_in_check(self._turn)
+    def generate_legal_moves(self):
+        # Moves of generate_all_moves not leaving the king in check
+        for move in list(self.generate_all_moves()):
+            if not self.leaves_king_in_check(move):
+                yield move
     
     def piece_at(self, uci):
         """Piece at UCI coords"""
@@ -223,39 +551,210 @@ class MiniChess(BitBoard):
         if self._turn == 1:
             x, y = self.mirror_coords(x, y)
 
-        return self._board[y][x]
+        code = self.piece_code_at(y * self.col + x)
+        return "." if code is None else PIECE_SYMBOLS[code]
     
     def piece_map(self):
         # Stale pieces
-        for y in range(self.row):
-            for x in range(self.col):
-                piece = self._board[y][x]
-                if piece == ".":
-                    continue
-                mirror_x, mirror_y = self.mirror_coords(x, y)
-                yield mirror_x, mirror_y
+        for bit_digit in self.iter_bits(self.white_pieces | self.black_pieces):
+            mirror_x, mirror_y = self.mirror_coords(*self.digit_to_coords(bit_digit))
+            yield mirror_x, mirror_y
         
         # Moving pieces
-        for i in len(self._moving_queue):
-            mirror_x, mirror_y = self.mirror_coords(self._moving_queue[i]["to_coord"])
+        for moving_piece in self._moving_queue:
+            mirror_x, mirror_y = self.mirror_coords(*self.digit_to_coords(moving_piece.to_digit))
             yield mirror_x, mirror_y
             
 
     def generate_all_moves(self):
-        # Loop over all board positions
-        for y in range(self.row):
-            for x in range(self.col):
-                piece = self._board[y][x]
-                if piece != ".":
-                    # Filter pieces by color
-                    if (self._turn == 0 and piece.isupper()):
-                        # Generate moves for the current piece
-                        valid_moves = self.generate_valid_moves(x, y, piece.lower())
-                        for move in valid_moves:
-                            yield self.coords_to_move(x, y, move[0], move[1])
-                    elif (self._turn == 1 and piece.islower()):
-                        # Generate moves for the current piece
-                        valid_moves = self.generate_valid_moves(x, y, piece.lower())
-                        for move in valid_moves:
-                            mirror_x, mirror_y = self.mirror_coords(x, y)
-                            yield self.coords_to_move(mirror_x, mirror_y, move[0], move[1])
\ No newline at end of file
+        # Loop over the pieces of the side to move, reusing the cached destination masks
+        own = self.white_pieces if self._turn == 0 else self.black_pieces
+        targets = self.legal_targets()
+        for bit_digit in self.iter_bits(own):
+            from_x, from_y = self.digit_to_coords(bit_digit)
+            if self._turn == 1:
+                from_x, from_y = self.mirror_coords(from_x, from_y)
+            for to_digit in self.iter_bits(targets[bit_digit]):
+                to_x, to_y = self.digit_to_coords(to_digit)
+                if self._turn == 1:
+                    to_x, to_y = self.mirror_coords(to_x, to_y)
+                yield self.coords_to_move(from_x, from_y, to_x, to_y)
+
+    def _digits_to_uci(self, from_digit, to_digit):
+        from_x, from_y = self.digit_to_coords(from_digit)
+        to_x, to_y = self.digit_to_coords(to_digit)
+        if self._turn == 1:
+            from_x, from_y = self.mirror_coords(from_x, from_y)
+            to_x, to_y = self.mirror_coords(to_x, to_y)
+        return self.coords_to_move(from_x, from_y, to_x, to_y)
+
+    def _square_to_digit(self, square):
+        # Bit digit of a UCI square relative to the side to move
+        x = ord(square[0]) - ord("a")
+        y = self.row - int(square[1:])
+        if not (0 <= x < self.col and 0 <= y < self.row):
+            raise ValueError(f"Square {square!r} is off the board")
+        if self._turn == 1:
+            x, y = self.mirror_coords(x, y)
+        return y * self.col + x
+
+    def _iter_targets(self, within, stay=False):
+        # (from_digit, destination mask) of the pieces of the side to move with destinations within,
+        # masks ANDed before any bit is iterated
+        targets = self._legal_targets
+        if targets is not None:
+            for from_digit in self.iter_bits(self.get_color_bits(self._turn)):
+                bit = 1 << from_digit
+                mask = (targets[from_digit] & within & ~bit) | (bit if stay else 0)
+                if mask:
+                    yield from_digit, mask
+            return
+
+        offset = self._turn * BLACK_OFFSET
+        for code in range(offset, offset + BLACK_OFFSET):
+            for from_digit in self.iter_bits(self.pieces[code]):
+                mask = (self.piece_targets(from_digit, code) & within) | ((1 << from_digit) if stay else 0)
+                if mask:
+                    yield from_digit, mask
+
+    def generate_captures(self):
+        # Moves of the side to move onto enemy pieces
+        for from_digit, mask in self._iter_targets(self.get_color_bits(1 - self._turn)):
+            for to_digit in self.iter_bits(mask):
+                yield self._digits_to_uci(from_digit, to_digit)
+
+    def generate_quiets(self):
+        # Moves of the side to move onto empty squares, and staying
+        empty = self.geometry.full_mask ^ (self.white_pieces | self.black_pieces)
+        for from_digit, mask in self._iter_targets(empty, stay=True):
+            for to_digit in self.iter_bits(mask):
+                yield self._digits_to_uci(from_digit, to_digit)
+
+    def generate_moves_from(self, square):
+        """ Moves of the piece of the side to move on the UCI square, staying included """
+        from_digit = self._square_to_digit(square)
+        if not (self.get_color_bits(self._turn) >> from_digit) & 1:
+            return
+        if self._legal_targets is not None:
+            mask = self._legal_targets[from_digit]
+        else:
+            mask = self.piece_targets(from_digit, self.piece_code_at(from_digit)) | (1 << from_digit)
+        for to_digit in self.iter_bits(mask):
+            yield self._digits_to_uci(from_digit, to_digit)
+
+    def generate_moves_to(self, square):
+        """ Moves of the side to move ending on the UCI square, staying included """
+        to_digit = self._square_to_digit(square)
+        bit = 1 << to_digit
+        turn = self._turn
+        own = self.get_color_bits(turn)
+        if own & bit:
+            # Own pieces only stay on their square
+            yield self._digits_to_uci(to_digit, to_digit)
+            return
+
+        # Pieces attacking the square reach it, pawns only to capture,
+        # looked up backwards from the square
+        pawn_code = turn * BLACK_OFFSET + PAWN
+        pawns = self.pieces[pawn_code]
+        sources = self.attackers_to(to_digit, turn)
+        if not self.get_color_bits(1 - turn) & bit:
+            sources &= ~pawns
+            # Pawns pushing one or two rows, the only candidates are on the file behind the square
+            backwards = self.geometry.pawn_pushes[1 - turn]
+            behind = backwards[to_digit]
+            if behind:
+                behind |= backwards[behind.bit_length() - 1]
+            for from_digit in self.iter_bits(behind & pawns):
+                if (self.piece_targets(from_digit, pawn_code) >> to_digit) & 1:
+                    sources |= 1 << from_digit
+        for from_digit in self.iter_bits(sources):
+            yield self._digits_to_uci(from_digit, to_digit)
+
+    def generate_moves_encoded(self):
+        """
+        Moves of the side to move as an array('H') of encoded moves, see moves.py.
+        The array exposes the buffer protocol, e.g. numpy.frombuffer(moves, numpy.uint16).
+        """
+        if self.row * self.col > MAX_SQUARES:
+            raise ValueError(f"Encoded moves support up to {MAX_SQUARES} squares")
+
+        moves = array("H")
+        append = moves.append
+        offset = self._turn * BLACK_OFFSET
+        enemy = self.black_pieces if self._turn == 0 else self.white_pieces
+        promotion_row = self.board_mask[-1 if self._turn else 0]
+        for code in range(offset, offset + BLACK_OFFSET):
+            for from_digit in self.iter_bits(self.pieces[code]):
+                # Make staling a valid move
+                append(encode_move(from_digit, from_digit, FLAG_STAY))
+                targets = self.piece_targets(from_digit, code)
+                promotions = promotion_row if code == offset + PAWN else 0
+                for to_digit in self.iter_bits(targets):
+                    bit = 1 << to_digit
+                    flags = (FLAG_CAPTURE if bit & enemy else 0) | (FLAG_PROMOTION if bit & promotions else 0)
+                    append(encode_move(from_digit, to_digit, flags))
+        return moves
+
+    def to_planes(self, out=None):
+        """ NumPy planes of the position, of shape (PLANES, row, col), see encoding.py """
+        from .encoding import encode_batch
+
+        if out is not None:
+            out = out[None]
+        return encode_batch([self], out)[0]
+
+    def perft(self, depth):
+        """
+        Count the leaves of the move tree depth plies deep, a ply being a push of the side
+        to move, one update_time and a change of turn. Games won end their branch, and a side
+        with every piece in flight passes, its ply being the update_time alone.
+        """
+        if depth == 0 or self.has_winner() is not None:
+            return 1
+
+        turn = self._turn
+        if not self.get_color_bits(turn):
+            if depth == 1:
+                return 1
+            self._advance(1)
+            self.cur_color("b" if turn == 0 else "w")
+            nodes = self.perft(depth - 1)
+            self.cur_color("w" if turn == 0 else "b")
+            self.rewind_time()
+            return nodes
+
+        targets = self.legal_targets()
+        if depth == 1:
+            # Bulk count, every child is a leaf
+            return sum(bin(mask).count("1") for mask in targets if mask)
+
+        nodes = 0
+        for from_digit, mask in enumerate(targets):
+            for to_digit in self.iter_bits(mask):
+                self._play(from_digit, to_digit)
+                self._advance(1)
+                self.cur_color("b" if turn == 0 else "w")
+                nodes += self.perft(depth - 1)
+                self.cur_color("w" if turn == 0 else "b")
+                self.rewind_time()
+                self.pop()
+        return nodes
+
+    def divide(self, depth):
+        """ perft split by root move, as {uci: leaves}, {None: leaves} for a pass """
+        turn = self._turn
+        if not self.get_color_bits(turn):
+            return {None: self.perft(depth)}
+        counts = {}
+        for from_digit, mask in enumerate(list(self.legal_targets())):
+            for to_digit in self.iter_bits(mask):
+                move = self._digits_to_uci(from_digit, to_digit)
+                self._play(from_digit, to_digit)
+                self._advance(1)
+                self.cur_color("b" if turn == 0 else "w")
+                counts[move] = self.perft(depth - 1)
+                self.cur_color("w" if turn == 0 else "b")
+                self.rewind_time()
+                self.pop()
+        return counts
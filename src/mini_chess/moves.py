@@ -0,0 +1,40 @@
+"""
+Moves packed into 16-bit ints
+
++-------+-----------+-------------+
+| flags |  to digit |  from digit |
+| 15-12 |   11-6    |     5-0     |
++-------+-----------+-------------+
+
+Digits are the absolute bit digits of BitBoard, for both colors, so boards
+up to 64 squares can be encoded. Conversion to UCI, which is relative to
+the side to move, is done by MiniChess.encoded_to_uci/uci_to_encoded.
+"""
+
+SQUARE_BITS = 6
+SQUARE_MASK = (1 << SQUARE_BITS) - 1
+MAX_SQUARES = 1 << SQUARE_BITS
+FLAGS_SHIFT = SQUARE_BITS * 2
+
+# The piece stays where it is
+FLAG_STAY = 1
+# The destination holds an enemy piece
+FLAG_CAPTURE = 2
+# A pawn reaches the last row
+FLAG_PROMOTION = 4
+
+
+def encode_move(from_digit, to_digit, flags=0):
+    return from_digit | (to_digit << SQUARE_BITS) | (flags << FLAGS_SHIFT)
+
+
+def move_from(move):
+    return move & SQUARE_MASK
+
+
+def move_to(move):
+    return (move >> SQUARE_BITS) & SQUARE_MASK
+
+
+def move_flags(move):
+    return move >> FLAGS_SHIFT
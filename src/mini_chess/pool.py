@@ -0,0 +1,58 @@
+"""
+Pool of MiniChess games for workers playing many short games or rollouts.
+
+acquire() hands out a released game reset to a starting position with
+MiniChess.reset, which copies the cached parsed board instead of parsing
+it, or a new game when none is free. release() takes a game back, up to
+max_size games are kept. Game end listeners are cleared on release so a
+game doesn't call back into the code that used it before.
+
+    pool = GamePool(GARDNER_BOARD, move_time=3)
+    with pool.game() as game:
+        ...
+"""
+
+from contextlib import contextmanager
+
+from .mini_chess import MiniChess
+from .board_example import GARDNER_BOARD
+
+
+class GamePool:
+    def __init__(self, board=GARDNER_BOARD, move_time=1, max_size=64):
+        self.board = board
+        self.move_time = move_time
+        self.max_size = max_size
+        self._free = []
+        self.created = 0
+        self.reused = 0
+
+    def __len__(self):
+        return len(self._free)
+
+    def acquire(self, board=None, move_time=None):
+        """ A game at the start of board, the pool's board and move_time unless given """
+        board = self.board if board is None else board
+        move_time = self.move_time if move_time is None else move_time
+        if self._free:
+            game = self._free.pop()
+            game.reset(board, move_time)
+            self.reused += 1
+            return game
+        self.created += 1
+        return MiniChess(board, move_time)
+
+    def release(self, game):
+        """ Give a game back, it must not be used afterwards """
+        if len(self._free) < self.max_size:
+            game._game_end_listeners = None
+            self._free.append(game)
+
+    @contextmanager
+    def game(self, board=None, move_time=None):
+        """ acquire() a game for the with block, released on exit """
+        game = self.acquire(board, move_time)
+        try:
+            yield game
+        finally:
+            self.release(game)
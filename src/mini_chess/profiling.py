@@ -0,0 +1,203 @@
+"""
+Opt-in profiling counters of the hot paths of MiniChess.
+
+Profiler.instrument(game) swaps the class of a game for a subclass whose
+hot methods, HOT_METHODS, count their calls and time, so games left alone
+run the plain methods without any check. Clones of an instrumented game
+are instrumented too, and instrumented_class(MiniChess) builds instrumented
+games directly.
+
+Times are inclusive, e.g. update_time includes its advance, and the time
+of a generator is spent inside it, between the moves it yields. Besides
+calls and seconds per method, a profiler counts:
+
+nodes_generated     moves yielded by the move generators, see NODE_GENERATORS
+positions_cached    legal_targets masks built for a position, not read from cache
+arrivals_landed     pieces landed by _tick, the clock behind advance and
+                    update_time and the _advance of perft and searches
+
+snapshot() returns everything as a dict, prometheus() as Prometheus text,
+and start_dumps(path, interval) rewrites that text to a local file every
+interval seconds from a daemon thread, e.g. for a node exporter textfile
+collector. A profiler counts the games of its own process only.
+"""
+
+import inspect
+import os
+import threading
+import time
+
+from .mini_chess import MiniChess
+
+HOT_METHODS = ("generate_all_moves", "generate_legal_moves", "generate_valid_moves", "generate_moves_encoded",
+               "generate_captures", "generate_quiets", "generate_moves_from", "generate_moves_to",
+               "legal_targets", "piece_targets", "attackers_to", "mirror", "is_in_check", "is_legal_move",
+               "has_winner", "push", "pop", "advance", "_advance", "_tick", "update_time", "rewind_time",
+               "zobrist_hash")
+# Their yields are moves; generate_legal_moves filters generate_all_moves, already counted
+NODE_GENERATORS = frozenset(name for name in HOT_METHODS if name.startswith("generate_")) - {"generate_legal_moves"}
+COUNTERS = ("nodes_generated", "positions_cached", "arrivals_landed")
+PROMETHEUS_PREFIX = "mini_chess"
+
+
+def _timed(profiler, name, method):
+    calls = profiler.calls
+    seconds = profiler.seconds
+    counters = profiler.counters
+    clock = time.perf_counter
+
+    if name == "legal_targets":
+        def wrapper(self):
+            if self._legal_targets is None:
+                counters["positions_cached"] += 1
+            start = clock()
+            try:
+                return method(self)
+            finally:
+                seconds[name] += clock() - start
+                calls[name] += 1
+    elif name == "_tick":
+        def wrapper(self, ticks):
+            start = clock()
+            try:
+                arrivals, entry = method(self, ticks)
+            finally:
+                seconds[name] += clock() - start
+                calls[name] += 1
+            counters["arrivals_landed"] += len(arrivals)
+            return arrivals, entry
+    elif inspect.isgeneratorfunction(method):
+        counted = name in NODE_GENERATORS
+
+        def wrapper(self, *args, **kwargs):
+            calls[name] += 1
+            start = clock()
+            iterator = method(self, *args, **kwargs)
+            seconds[name] += clock() - start
+            while True:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    seconds[name] += clock() - start
+                    return
+                seconds[name] += clock() - start
+                if counted:
+                    counters["nodes_generated"] += 1
+                yield item
+    else:
+        counted = name in NODE_GENERATORS
+
+        def wrapper(self, *args, **kwargs):
+            start = clock()
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                seconds[name] += clock() - start
+                calls[name] += 1
+            if counted:
+                # generate_moves_encoded returns an array of the moves
+                counters["nodes_generated"] += len(result)
+            return result
+
+    wrapper.__name__ = method.__name__
+    wrapper.__qualname__ = method.__qualname__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class Profiler:
+    def __init__(self):
+        self.calls = {name: 0 for name in HOT_METHODS}
+        self.seconds = {name: 0.0 for name in HOT_METHODS}
+        self.counters = {name: 0 for name in COUNTERS}
+        self.started = time.time()
+        # Instrumented subclass by class
+        self._classes = {}
+        self._dump_stop = None
+        self._dump_thread = None
+
+    def instrumented_class(self, cls=MiniChess):
+        """ Subclass of cls, MiniChess or a subclass of it, counting into this profiler """
+        subclass = self._classes.get(cls)
+        if subclass is None:
+            # No new slots, so games can switch to and from it
+            namespace = {"__slots__": (), "__module__": cls.__module__, "profiler": self}
+            for name in HOT_METHODS:
+                namespace[name] = _timed(self, name, getattr(cls, name))
+            subclass = self._classes[cls] = type(f"Instrumented{cls.__name__}", (cls,), namespace)
+        return subclass
+
+    def instrument(self, game):
+        """ Count the game's hot paths from now on, return the game """
+        cls = type(game)
+        if getattr(cls, "profiler", None) is not None:
+            cls = cls.__bases__[0]
+        game.__class__ = self.instrumented_class(cls)
+        return game
+
+    @staticmethod
+    def uninstrument(game):
+        """ Back to the plain methods, return the game """
+        if getattr(type(game), "profiler", None) is not None:
+            game.__class__ = type(game).__bases__[0]
+        return game
+
+    def reset(self):
+        for name in HOT_METHODS:
+            self.calls[name] = 0
+            self.seconds[name] = 0.0
+        for name in COUNTERS:
+            self.counters[name] = 0
+        self.started = time.time()
+
+    def snapshot(self):
+        """ Counters since creation or reset, methods never called left out """
+        return {
+            "seconds": time.time() - self.started,
+            "methods": {name: {"calls": self.calls[name], "seconds": self.seconds[name]}
+                        for name in HOT_METHODS if self.calls[name]},
+            **{name: self.counters[name] for name in COUNTERS},
+        }
+
+    def prometheus(self):
+        """ The counters in Prometheus text exposition format """
+        prefix = PROMETHEUS_PREFIX
+        lines = [f"# HELP {prefix}_calls_total Calls of the instrumented MiniChess methods.",
+                 f"# TYPE {prefix}_calls_total counter"]
+        lines += [f'{prefix}_calls_total{{method="{name}"}} {self.calls[name]}' for name in HOT_METHODS]
+        lines += [f"# HELP {prefix}_seconds_total Seconds spent in the instrumented MiniChess methods, inclusive.",
+                  f"# TYPE {prefix}_seconds_total counter"]
+        lines += [f'{prefix}_seconds_total{{method="{name}"}} {self.seconds[name]:.9f}' for name in HOT_METHODS]
+        for name in COUNTERS:
+            lines += [f"# HELP {prefix}_{name}_total {name.replace('_', ' ').capitalize()}.",
+                      f"# TYPE {prefix}_{name}_total counter",
+                      f"{prefix}_{name}_total {self.counters[name]}"]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """ Write prometheus() to path, replacing the file at once so readers never see half of it """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(self.prometheus())
+        os.replace(temporary, path)
+
+    def start_dumps(self, path, interval=15.0):
+        """ dump(path) every interval seconds from a daemon thread until stop_dumps() """
+        self.stop_dumps()
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                self.dump(path)
+
+        self._dump_stop = stop
+        self._dump_thread = threading.Thread(target=loop, name="mini_chess-profiler", daemon=True)
+        self._dump_thread.start()
+
+    def stop_dumps(self):
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
+            self._dump_stop = None
@@ -0,0 +1,388 @@
+"""
+Binary states and game records.
+
+StateCodec packs a whole MiniChess state into a fixed number of bytes for
+a board size, little-endian:
+
+header      row, col, turn (B each), pieces in flight, move_time (H each), time (I)
+pieces      12 bitboards of ceil(squares / 8) bytes, by piece code
+in flight   max_flight slots of code, from digit, to digit (B each) and ticks
+            left (H), in landing order, unused slots zeroed
+
+Boards are limited to 256 squares, and max_flight defaults to the square
+count, the most pieces a board can hold.
+
+A game record file stores many games, appended tick by tick and possibly
+interleaved, as chunks of kind, game id, tick (host tick or game time),
+payload length and the offset of the previous chunk of the same game, 0
+for its first one (BIIHQ), after a file header:
+
+SNAPSHOT    a StateCodec state, after the moves of the tick
+TICK        the pieces landed then the moves pushed on the tick, as counts
+            (B) followed by code, from digit, to digit (B each) per
+            arrival and color, from digit, to digit per move
+
+Every snapshot_interval ticks of a game a snapshot is written and its
+offset appended to the index file, path + ".idx", as kind, game id, tick
+and offset (BIIQ). finish(game_id), and close() for the games left, append
+an END entry with the offset of the last chunk of the game. GameRecordReader
+maps both files with mmap and rebuilds the position of a game at any
+recorded tick from the latest snapshot before it: it follows the links
+back from the next snapshot of the game, or from its END, so it reads the
+at most snapshot_interval chunks of that game, whatever the games
+interleaved with it. Games without an END, e.g. of a writer still open,
+are scanned forward from their last snapshot to the end of the file, as
+are chains whose links don't lead back to the snapshot. A writer reopened
+on a file finds the last chunk of such games the same way, so its links
+carry on whether or not the writer before it was closed.
+"""
+
+import mmap
+import os
+import struct
+from bisect import bisect_right
+
+from .mini_chess import MiniChess, MovingPiece
+from .bit_board import PIECE_SYMBOLS, BLACK_OFFSET, KING
+
+MAX_SQUARES = 256
+VERSION = 2
+
+_STATE_HEADER = struct.Struct("<BBBHHI")
+_FLIGHT_SLOT = struct.Struct("<BBBH")
+_FILE_HEADER = struct.Struct("<4sHBBHH")
+_CHUNK = struct.Struct("<BIIHQ")
+_INDEX_ENTRY = struct.Struct("<BIIQ")
+_MAGIC = b"MCGR"
+
+# Kinds of chunks, and of index entries for SNAPSHOT and END
+SNAPSHOT = 0
+TICK = 1
+END = 2
+
+
+class StateCodec:
+    def __init__(self, row, col, max_flight=None):
+        squares = row * col
+        if squares > MAX_SQUARES:
+            raise ValueError(f"Binary states support up to {MAX_SQUARES} squares")
+        self.row = row
+        self.col = col
+        self.max_flight = squares if max_flight is None else max_flight
+        self.bitboard_bytes = (squares + 7) // 8
+        self.size = (_STATE_HEADER.size + len(PIECE_SYMBOLS) * self.bitboard_bytes
+                     + self.max_flight * _FLIGHT_SLOT.size)
+        self._empty_board = ["." * col] * row
+
+    def encode(self, game):
+        buffer = bytearray(self.size)
+        self.encode_into(game, buffer)
+        return bytes(buffer)
+
+    def encode_into(self, game, buffer, offset=0):
+        """ Write the state of the game into a writable buffer at offset """
+        if (game.row, game.col) != (self.row, self.col):
+            raise ValueError(f"Expected a {self.row}x{self.col} board, got {game.row}x{game.col}")
+        in_flight = game._moving_queue
+        if len(in_flight) > self.max_flight:
+            raise ValueError(f"{len(in_flight)} pieces in flight, more than max_flight {self.max_flight}")
+
+        _STATE_HEADER.pack_into(buffer, offset, self.row, self.col, game._turn, len(in_flight),
+                                game._move_time, game._time)
+        offset += _STATE_HEADER.size
+        width = self.bitboard_bytes
+        for bits in game.pieces:
+            buffer[offset:offset + width] = bits.to_bytes(width, "little")
+            offset += width
+        for moving_piece in in_flight:
+            _FLIGHT_SLOT.pack_into(buffer, offset, moving_piece.code, moving_piece.from_digit,
+                                   moving_piece.to_digit, moving_piece.time_at - game._time)
+            offset += _FLIGHT_SLOT.size
+        unused = (self.max_flight - len(in_flight)) * _FLIGHT_SLOT.size
+        buffer[offset:offset + unused] = bytes(unused)
+
+    def decode(self, buffer, offset=0):
+        """ MiniChess of the state at offset of a buffer, e.g. an mmap, without undo history """
+        row, col, turn, count, move_time, time_now = _STATE_HEADER.unpack_from(buffer, offset)
+        if (row, col) != (self.row, self.col):
+            raise ValueError(f"Expected a {self.row}x{self.col} state, got {row}x{col}")
+        offset += _STATE_HEADER.size
+
+        game = MiniChess(self._empty_board, move_time)
+        width = self.bitboard_bytes
+        for code in range(len(PIECE_SYMBOLS)):
+            bits = int.from_bytes(buffer[offset:offset + width], "little")
+            offset += width
+            for bit_digit in game.iter_bits(bits):
+                game.land(bit_digit, code)
+
+        game._time = time_now
+        for code, from_digit, to_digit, ticks_left in _FLIGHT_SLOT.iter_unpack(
+                buffer[offset:offset + count * _FLIGHT_SLOT.size]):
+            if code % BLACK_OFFSET == KING:
+                game._kings_in_flight[code // BLACK_OFFSET] += 1
+            game._schedule(MovingPiece(code, from_digit, to_digit, time_now + ticks_left), False)
+        game._rehash_flight()
+        game.cur_color("b" if turn else "w")
+        return game
+
+
+def _uci_to_digits(game, uci, color):
+    # Digits of a UCI move relative to the color
+    from_x, from_y, to_x, to_y = game.move_to_coords(uci)
+    if color == 1:
+        from_x, from_y = game.mirror_coords(from_x, from_y)
+        to_x, to_y = game.mirror_coords(to_x, to_y)
+    return from_y * game.col + from_x, to_y * game.col + to_x
+
+
+class GameRecordWriter:
+    def __init__(self, path, row, col, snapshot_interval=32, max_flight=None):
+        """ Append to the record file at path, created if missing """
+        self.codec = StateCodec(row, col, max_flight)
+        self.snapshot_interval = snapshot_interval
+        header = _FILE_HEADER.pack(_MAGIC, VERSION, row, col, self.codec.max_flight, snapshot_interval)
+        # Offset and tick of the last chunk of each game, the previous link of its next chunk
+        self._last = {}
+        unended = {}
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                if f.read(_FILE_HEADER.size) != header:
+                    raise ValueError(f"{path} holds records of another board or format")
+            # Games recorded before go on from their END, with a new snapshot on their next tick
+            snapshots = {}
+            if os.path.exists(path + ".idx"):
+                with open(path + ".idx", "rb") as f:
+                    for kind, game_id, tick, offset in _INDEX_ENTRY.iter_unpack(f.read()):
+                        if kind == END:
+                            self._last[game_id] = (offset, tick)
+                        else:
+                            snapshots[game_id] = offset
+            # Games without an END after their last snapshot, e.g. of a writer not closed,
+            # go on from their last chunk, found scanning forward from that snapshot
+            unended.update((game_id, offset) for game_id, offset in snapshots.items()
+                           if game_id not in self._last or self._last[game_id][0] < offset)
+            self._file = open(path, "r+b")
+            if unended:
+                end = _scan_last(self._file, min(unended.values()), unended, self._last)
+                # Drop a chunk cut short by a crash, records go on after the last whole one
+                self._file.truncate(end)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(header)
+        self._index = open(path + ".idx", "ab")
+        # Tick of the last snapshot of each game
+        self._snapshots = {}
+        # Games whose last chunk has an END entry
+        self._ended = set(self._last) - set(unended)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Write the END entries of the games not finished, then close the files """
+        for game_id in list(self._last):
+            if game_id not in self._ended:
+                self.finish(game_id)
+        self._file.close()
+        self._index.close()
+
+    def begin(self, game_id, game, tick=0):
+        """ Snapshot the game before its first recorded tick """
+        self._snapshot(game_id, game, tick)
+
+    def record(self, game_id, game, tick, arrivals=(), moves=()):
+        """
+        Append a tick of a game after it was played: arrivals as returned by update_time
+        or advance, then moves as (color, uci) pushed on the tick
+        """
+        payload = bytearray([len(arrivals)])
+        for uci, piece in arrivals:
+            color = 0 if piece.isupper() else 1
+            payload += bytes((PIECE_SYMBOLS.index(piece), *_uci_to_digits(game, uci, color)))
+        payload.append(len(moves))
+        for color, uci in moves:
+            payload += bytes((color, *_uci_to_digits(game, uci, color)))
+        self._chunk(TICK, game_id, tick, payload)
+
+        last = self._snapshots.get(game_id)
+        if last is None or tick - last >= self.snapshot_interval:
+            self._snapshot(game_id, game, tick)
+
+    def finish(self, game_id):
+        """ Write the END entry of a game, e.g. once won, so readers find its last chunk """
+        offset, tick = self._last[game_id]
+        self._index.write(_INDEX_ENTRY.pack(END, game_id, tick, offset))
+        self._ended.add(game_id)
+
+    def _chunk(self, kind, game_id, tick, payload):
+        offset = self._file.tell()
+        previous = self._last.get(game_id, (0, 0))[0]
+        self._file.write(_CHUNK.pack(kind, game_id, tick, len(payload), previous))
+        self._file.write(payload)
+        self._last[game_id] = (offset, tick)
+        self._ended.discard(game_id)
+        return offset
+
+    def _snapshot(self, game_id, game, tick):
+        offset = self._chunk(SNAPSHOT, game_id, tick, self.codec.encode(game))
+        self._index.write(_INDEX_ENTRY.pack(SNAPSHOT, game_id, tick, offset))
+        self._snapshots[game_id] = tick
+
+
+def _scan_last(f, offset, games, last):
+    """
+    Set last[game_id] to the (offset, tick) of the last chunk of each of games in the file f
+    from offset on, return the offset after the last whole chunk
+    """
+    f.seek(offset)
+    data = f.read()
+    end = len(data)
+    position = 0
+    while position + _CHUNK.size <= end:
+        kind, game_id, tick, length, _ = _CHUNK.unpack_from(data, position)
+        if position + _CHUNK.size + length > end:
+            break
+        if game_id in games:
+            last[game_id] = (offset + position, tick)
+        position += _CHUNK.size + length
+    return offset + position
+
+
+def _map(path):
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class GameRecordReader:
+    def __init__(self, path):
+        self._data = _map(path)
+        magic, version, row, col, max_flight, snapshot_interval = _FILE_HEADER.unpack_from(self._data, 0)
+        if magic != _MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} game record file")
+        self.codec = StateCodec(row, col, max_flight)
+        self.snapshot_interval = snapshot_interval
+        self._index = _map(path + ".idx")
+        # Snapshot ticks and offsets by game, in recording order, and the offset of the
+        # last chunk of the finished games
+        self._snapshots = {}
+        self._ends = {}
+        for kind, game_id, tick, offset in _INDEX_ENTRY.iter_unpack(self._index):
+            if kind == END:
+                self._ends[game_id] = offset
+                continue
+            ticks, offsets = self._snapshots.setdefault(game_id, ([], []))
+            ticks.append(tick)
+            offsets.append(offset)
+        for game_id, offset in list(self._ends.items()):
+            # Recorded on after its END by a writer not closed
+            if offset < self._snapshots[game_id][1][-1]:
+                del self._ends[game_id]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for mapped in (self._data, self._index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def games(self):
+        return list(self._snapshots)
+
+    def snapshot_ticks(self, game_id):
+        return list(self._snapshots[game_id][0])
+
+    def ticks(self, game_id, start=0):
+        """ (tick, arrivals, moves) of a game from the snapshot before start, digits as in TICK chunks """
+        ticks, offsets = self._snapshots[game_id]
+        index = max(0, bisect_right(ticks, start) - 1)
+        chunks = self._game_chunks(game_id, offsets[index], self._ends.get(game_id))
+        for kind, tick, payload in chunks:
+            if kind == TICK and tick >= start:
+                yield (tick,) + _unpack_tick(payload)
+
+    def position(self, game_id, tick):
+        """ MiniChess of a game after the moves of a recorded tick """
+        ticks, offsets = self._snapshots.get(game_id, ((), ()))
+        index = bisect_right(ticks, tick) - 1
+        if index < 0:
+            raise KeyError(f"No snapshot of game {game_id} at or before tick {tick}")
+        offset = offsets[index]
+        start = ticks[index]
+        game = self.codec.decode(self._data, offset + _CHUNK.size)
+        # Game time of the snapshot tick, as ticks may be host ticks
+        base = game._time - start
+        if index + 1 < len(offsets):
+            # The chunk before the next snapshot of the game
+            top = _CHUNK.unpack_from(self._data, offsets[index + 1])[4]
+        else:
+            top = self._ends.get(game_id)
+        for kind, chunk_tick, payload in self._game_chunks(game_id, offset, top):
+            if kind != TICK:
+                continue
+            if chunk_tick > tick:
+                break
+            game.advance(base + chunk_tick - game._time)
+            for color, from_digit, to_digit in _unpack_tick(payload)[1]:
+                game.cur_color("b" if color else "w")
+                if not game.is_legal_digits(from_digit, to_digit):
+                    raise ValueError(f"Illegal move recorded for game {game_id} at tick {chunk_tick}")
+                game._push_digits(from_digit, to_digit)
+        game.advance(base + tick - game._time)
+        return game
+
+    def _game_chunks(self, game_id, bottom, top):
+        """
+        (kind, tick, payload) of the chunks of a game after the one at offset bottom up to the
+        one at offset top, following the previous links back, or scanning forward to top, or
+        to the end of the file without top, when they don't lead to bottom
+        """
+        data = self._data
+        chunks = []
+        link = top
+        while link is not None and link > bottom:
+            kind, _, tick, length, previous = _CHUNK.unpack_from(data, link)
+            # Payloads are copied, no view of the map outlives a call
+            chunks.append((kind, tick, data[link + _CHUNK.size:link + _CHUNK.size + length]))
+            link = previous
+        if link == bottom:
+            chunks.reverse()
+            return chunks
+        # No top, or a link broken by a writer not closed: scan forward up to top
+        chunks = []
+        for offset, kind, chunk_game, tick, payload in self._chunks(bottom):
+            if chunk_game == game_id and offset != bottom:
+                chunks.append((kind, tick, payload))
+            if offset == top:
+                break
+        return chunks
+
+    def _chunks(self, offset):
+        # (offset, kind, game id, tick, payload) of the chunks from offset on, payloads copied
+        data = self._data
+        end = len(data)
+        while offset + _CHUNK.size <= end:
+            kind, game_id, tick, length, _ = _CHUNK.unpack_from(data, offset)
+            if offset + _CHUNK.size + length > end:
+                return
+            yield offset, kind, game_id, tick, data[offset + _CHUNK.size:offset + _CHUNK.size + length]
+            offset += _CHUNK.size + length
+
+
+def _unpack_tick(payload):
+    count = payload[0]
+    arrivals = [tuple(payload[1 + 3 * i:4 + 3 * i]) for i in range(count)]
+    offset = 1 + 3 * count
+    moves = [tuple(payload[offset + 1 + 3 * i:offset + 4 + 3 * i]) for i in range(payload[offset])]
+    return arrivals, moves
+
@@ -0,0 +1,164 @@
+"""
+Self-play of many games across worker processes.
+
+A ply is played like perft: the side to move pushes the move of its
+policy, then the clock moves one tick, so with move_time above 1 pieces
+of both sides are in flight together. Games end on a king capture or
+after max_plies plies, a draw.
+
+A policy is a function policy(game, rng) returning a UCI move of the side
+to move, or the name of one in POLICIES. Policies run in the workers, so
+functions must be importable there, defined at module level. The engine
+policy searches ENGINE_NODES nodes per move with engine.Engine.
+
+Records are dicts streamed as games finish, in no particular order:
+index, moves (UCI relative to the side to move, white first, None when
+every piece of the side is in flight), winner
+(0, 1 or None), plies, worker (pid) and seconds.
+"""
+
+import multiprocessing
+import os
+import random
+import time
+
+from .mini_chess import MiniChess
+from .bit_board import BLACK_OFFSET, PIECE_VALUES
+from .moves import encode_move
+from .engine import Engine
+
+
+def random_policy(game, rng):
+    return rng.choice(list(game.generate_all_moves()))
+
+
+def greedy_policy(game, rng):
+    # Capture the most valuable enemy piece, any move otherwise
+    enemy = game.black_pieces if game._turn == 0 else game.white_pieces
+    best_value = 0
+    best = []
+    for from_digit, mask in enumerate(game.legal_targets()):
+        for to_digit in game.iter_bits(mask & enemy):
+            value = PIECE_VALUES[game.piece_code_at(to_digit) % BLACK_OFFSET]
+            if value > best_value:
+                best_value = value
+                best = [(from_digit, to_digit)]
+            elif value == best_value:
+                best.append((from_digit, to_digit))
+    if not best:
+        return random_policy(game, rng)
+    from_digit, to_digit = rng.choice(best)
+    return game.encoded_to_uci(encode_move(from_digit, to_digit))
+
+
+# Node budget of a move of engine_policy, tens of milliseconds
+ENGINE_NODES = 2000
+# Engine of the process, built on first use
+_engine = None
+
+
+def engine_policy(game, rng):
+    global _engine
+    if _engine is None:
+        _engine = Engine()
+    return _engine.search(game, node_limit=ENGINE_NODES).move
+
+
+POLICIES = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+    "engine": engine_policy,
+}
+
+
+def resolve_policy(policy):
+    """ Policy function of a name of POLICIES or a function """
+    if callable(policy):
+        return policy
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy {policy!r}, expected one of {', '.join(POLICIES)}")
+    return POLICIES[policy]
+
+
+def play_game(game, board, policies, max_plies, rng):
+    """ Play a game from board reusing the game object, return (moves, winner) """
+    game.reset(board)
+    moves = []
+    winner = None
+    for ply in range(max_plies):
+        color = ply % 2
+        game.cur_color("b" if color else "w")
+        if game.get_color_bits(color):
+            move = policies[color](game, rng)
+            if not game.push(move):
+                raise ValueError(f"Policy {policies[color].__name__} played the illegal move {move!r}")
+        else:
+            # Every piece of the side is in flight, it passes
+            move = None
+        moves.append(move)
+        game.update_time()
+        winner = game.has_winner()
+        if winner is not None:
+            break
+    return moves, winner
+
+
+# State of a worker process, set by _init_worker
+_worker = None
+
+
+def _init_worker(board, move_time, policies, max_plies, seed):
+    global _worker
+    _worker = (MiniChess(board, move_time), board, tuple(resolve_policy(policy) for policy in policies),
+               max_plies, seed)
+
+
+def _play_task(index):
+    game, board, policies, max_plies, seed = _worker
+    start = time.perf_counter()
+    # Seeded per game so records don't depend on the worker playing them
+    moves, winner = play_game(game, board, policies, max_plies, random.Random(seed * 1000003 + index))
+    return {"index": index, "moves": moves, "winner": winner, "plies": len(moves),
+            "worker": os.getpid(), "seconds": time.perf_counter() - start}
+
+
+class SelfPlayRunner:
+    def __init__(self, board, move_time=1, policies=("random", "random"), workers=None,
+                 max_plies=200, seed=0):
+        """ policies: (white, black), workers: process count, os.cpu_count() if None, 0 to play in process """
+        for policy in policies:
+            resolve_policy(policy)
+        self.board = board
+        self.move_time = move_time
+        self.policies = tuple(policies)
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_plies = max_plies
+        self.seed = seed
+        # Totals per worker pid, see stats
+        self._totals = {}
+
+    def play(self, games):
+        """ Play games games, yield their records as they finish """
+        initargs = (self.board, self.move_time, self.policies, self.max_plies, self.seed)
+        if self.workers == 0:
+            _init_worker(*initargs)
+            for index in range(games):
+                yield self._count(_play_task(index))
+            return
+
+        with multiprocessing.Pool(self.workers, _init_worker, initargs) as pool:
+            for record in pool.imap_unordered(_play_task, range(games)):
+                yield self._count(record)
+
+    def _count(self, record):
+        totals = self._totals.setdefault(record["worker"], [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += record["plies"]
+        totals[2] += record["seconds"]
+        return record
+
+    def stats(self):
+        """ Games, plies, seconds playing and plies per second by worker pid, over the records so far """
+        return {worker: {"games": games, "plies": plies, "seconds": seconds,
+                         "plies_per_sec": plies / seconds if seconds else 0.0}
+                for worker, (games, plies, seconds) in self._totals.items()}
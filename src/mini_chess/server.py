@@ -0,0 +1,277 @@
+"""
+Host of many real-time games on one asyncio tick loop.
+
+Every hosted game follows the host clock, one tick per tick_interval
+seconds, but a game is only touched on the ticks where one of its pieces
+lands or a client submitted moves for it. A woken game jumps its clock to
+the current tick with MiniChess.advance, landing what was due, then pushes
+the moves submitted since the last tick in submission order. Games wait
+for their next landing in a timing wheel, a dict of tick to the games to
+wake, so idle games cost nothing per tick.
+
+Subscribers of a game get events as dicts on an asyncio.Queue:
+
+{"type": "move", "game", "tick", "color", "move"}
+{"type": "arrival", "game", "tick", "move", "piece"}
+{"type": "winner", "game", "tick", "winner"}
+
+Moves and arrivals are UCI relative to the color moving. A game leaves
+the host once won. Run python -m mini_chess.server for the measurements of
+measure() with simulated clients. The clients run in the same process and
+event loop as the host, tick latencies include their work.
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import deque
+
+from .mini_chess import MiniChess
+from .board_example import GARDNER_BOARD
+
+# Ticks whose latency is kept for the stats
+LATENCY_SAMPLES = 10000
+
+
+class HostedGame:
+    __slots__ = ("game_id", "game", "start_tick", "pending", "subscribers", "wake_tick")
+
+    def __init__(self, game_id, game, start_tick):
+        self.game_id = game_id
+        self.game = game
+        # Host tick of the game's time 0
+        self.start_tick = start_tick
+        # (color, move, future) submitted since the last tick
+        self.pending = []
+        self.subscribers = []
+        # Tick of the next landing in the wheel, None if nothing is in flight
+        self.wake_tick = None
+
+
+class GameHost:
+    def __init__(self, tick_interval=0.05):
+        self.tick_interval = tick_interval
+        self.tick = 0
+        self._games = {}
+        self._next_id = 0
+        # Timing wheel, tick to the games waking then; a game rescheduled earlier leaves a
+        # stale entry behind, skipped as its wake_tick no longer matches
+        self._wheel = {}
+        # Games with submitted moves, in submission order
+        self._submitted = {}
+        self._running = False
+
+        self.busy_seconds = 0.0
+        self.woken = 0
+        self.moves = 0
+        self.arrivals = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def __len__(self):
+        return len(self._games)
+
+    def __contains__(self, game_id):
+        return game_id in self._games
+
+    def new_game(self, board=GARDNER_BOARD, move_time=1):
+        """ Host a new game starting on the next tick, return its id """
+        game_id = self._next_id
+        self._next_id += 1
+        self._games[game_id] = HostedGame(game_id, MiniChess(board, move_time), self.tick)
+        return game_id
+
+    def game(self, game_id):
+        """ The MiniChess of a hosted game, to be read between ticks only """
+        return self._hosted(game_id).game
+
+    def subscribe(self, game_id):
+        """ asyncio.Queue receiving the events of the game """
+        queue = asyncio.Queue()
+        self._hosted(game_id).subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, game_id, queue):
+        hosted = self._games.get(game_id)
+        if hosted is not None:
+            hosted.subscribers.remove(queue)
+
+    def submit(self, game_id, color, move):
+        """ Queue a UCI move of the color (0 white, 1 black) for the next tick, return a future of its legality """
+        hosted = self._hosted(game_id)
+        future = asyncio.get_running_loop().create_future()
+        hosted.pending.append((color, move, future))
+        self._submitted[game_id] = hosted
+        return future
+
+    def _hosted(self, game_id):
+        hosted = self._games.get(game_id)
+        if hosted is None:
+            raise KeyError(f"No game {game_id} on the host")
+        return hosted
+
+    def _publish(self, hosted, event):
+        for queue in hosted.subscribers:
+            queue.put_nowait(event)
+
+    def process_tick(self):
+        """ Move the host clock by one tick and update the games due, return how many were woken """
+        self.tick += 1
+        tick = self.tick
+        woken = {}
+        for hosted in self._wheel.pop(tick, ()):
+            if hosted.wake_tick == tick:
+                woken[hosted.game_id] = hosted
+        # Submitted moves are played after the landings of the tick
+        for game_id, hosted in self._submitted.items():
+            if game_id in self._games:
+                woken[game_id] = hosted
+        self._submitted = {}
+
+        for hosted in woken.values():
+            self._step(hosted, tick)
+        self.woken += len(woken)
+        return len(woken)
+
+    def _step(self, hosted, tick):
+        game = hosted.game
+        game_id = hosted.game_id
+        hosted.wake_tick = None
+        for move, piece in game.advance(tick - hosted.start_tick - game._time):
+            self.arrivals += 1
+            self._publish(hosted, {"type": "arrival", "game": game_id, "tick": tick, "move": move, "piece": piece})
+
+        winner = game.has_winner()
+        pending = hosted.pending
+        hosted.pending = []
+        for color, move, future in pending:
+            legal = winner is None
+            if legal:
+                game.cur_color("b" if color else "w")
+                legal = game.push(move)
+            if not future.done():
+                future.set_result(legal)
+            if legal:
+                self.moves += 1
+                self._publish(hosted, {"type": "move", "game": game_id, "tick": tick, "color": color, "move": move})
+
+        if winner is not None:
+            self._publish(hosted, {"type": "winner", "game": game_id, "tick": tick, "winner": winner})
+            del self._games[game_id]
+            return
+
+        next_arrival = game.next_arrival()
+        if next_arrival is not None:
+            hosted.wake_tick = hosted.start_tick + next_arrival
+            self._wheel.setdefault(hosted.wake_tick, []).append(hosted)
+
+    async def run(self, ticks=None):
+        """ Process a tick every tick_interval seconds, forever or for ticks ticks, until stop() """
+        loop = asyncio.get_running_loop()
+        self._running = True
+        start = loop.time()
+        count = 0
+        while self._running and (ticks is None or count < ticks):
+            count += 1
+            # Deadlines don't drift with late ticks
+            deadline = start + count * self.tick_interval
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            woke = loop.time()
+            self.process_tick()
+            done = loop.time()
+            self.busy_seconds += done - woke
+            # Latency of a tick, from its deadline to the end of its processing
+            self.latencies.append(done - deadline)
+        self._running = False
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        """ Tick latencies and processing time over the ticks run so far """
+        ticks = self.tick
+        latencies = sorted(self.latencies)
+        busy = self.busy_seconds / ticks if ticks else 0.0
+        return {
+            "ticks": ticks,
+            "games": len(self._games),
+            "moves": self.moves,
+            "arrivals": self.arrivals,
+            "woken_per_tick": self.woken / ticks if ticks else 0.0,
+            "busy_per_tick": busy,
+            "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+
+async def simulated_client(host, game_id, color, think_ticks, rng):
+    """ Play random moves of the color, thinking think_ticks ticks on average, until the game ends """
+    game = host.game(game_id)
+    while game_id in host:
+        await asyncio.sleep(rng.uniform(0, 2 * think_ticks) * host.tick_interval)
+        if game_id not in host:
+            break
+        # A random move of a random piece, cheaper than generating every move
+        game.cur_color("b" if color else "w")
+        pieces = list(game.iter_bits(game.get_color_bits(color)))
+        if pieces:
+            square = game._digits_to_uci(pieces[0], rng.choice(pieces))[2:]
+            await host.submit(game_id, color, rng.choice(list(game.generate_moves_from(square))))
+
+
+async def _measure(games, board, move_time, ticks, tick_interval, think_ticks, seed):
+    rng = random.Random(seed)
+    host = GameHost(tick_interval)
+    clients = []
+    for _ in range(games):
+        game_id = host.new_game(board, move_time)
+        for color in (0, 1):
+            clients.append(asyncio.ensure_future(
+                simulated_client(host, game_id, color, think_ticks, random.Random(rng.random()))))
+
+    start = time.perf_counter()
+    await host.run(ticks)
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.cancel()
+    await asyncio.gather(*clients, return_exceptions=True)
+
+    stats = host.stats()
+    # Share of a core taken by the host itself, and the games a core would keep at that load
+    load = stats["busy_per_tick"] / tick_interval
+    stats.update({"hosted": games, "finished": games - len(host), "seconds": elapsed,
+                  "host_load": load, "games_per_core": games / load if load else float("inf")})
+    return stats
+
+
+def measure(games=1000, board=GARDNER_BOARD, move_time=3, ticks=200, tick_interval=0.02, think_ticks=5, seed=0):
+    """ Host games played by simulated clients for ticks ticks, return the host stats """
+    return asyncio.run(_measure(games, board, move_time, ticks, tick_interval, think_ticks, seed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mini_chess.server",
+                                     description="tick latency of a host of games played by simulated clients")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--move-time", type=int, default=3)
+    parser.add_argument("--ticks", type=int, default=200)
+    parser.add_argument("--tick-interval", type=float, default=0.02, help="seconds")
+    parser.add_argument("--think-ticks", type=float, default=5, help="average ticks between two moves of a client")
+    args = parser.parse_args(argv)
+
+    stats = measure(args.games, GARDNER_BOARD, args.move_time, args.ticks, args.tick_interval, args.think_ticks)
+    print(f"{stats['hosted']} games, {stats['finished']} finished, {stats['moves']} moves, "
+          f"{stats['arrivals']} arrivals over {stats['ticks']} ticks")
+    print(f"tick latency mean {stats['latency_mean'] * 1000:.2f} ms, p99 {stats['latency_p99'] * 1000:.2f} ms, "
+          f"max {stats['latency_max'] * 1000:.2f} ms")
+    print(f"{stats['woken_per_tick']:.1f} games woken and {stats['busy_per_tick'] * 1000:.2f} ms busy per tick, "
+          f"host load {stats['host_load']:.0%}, {stats['games_per_core']:.0f} games per core")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
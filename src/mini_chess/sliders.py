@@ -0,0 +1,323 @@
+"""
+Occupancy-indexed attack tables for rooks, bishops and queens.
+
+Each square has four lines through it: its rank, its file and its two
+diagonals. For every line the relevant occupancy mask holds the squares a
+blocker could stand on, leaving out the square itself and the line's end
+squares, since a piece there never hides anything behind it. The table for
+a square and line maps every subset of that mask to the attacked squares,
+blockers included. Like magic/PEXT bitboards, a sliding attack is then a
+mask and a lookup per line. Python ints have no cheap PEXT, so the masked
+occupancy is used as a dict key directly instead of being compressed.
+
+Tables for larger boards, see DISK_CACHE_MIN_SQUARES, are kept on disk
+only when $MINI_CHESS_CACHE_DIR names a directory for them. Files hold
+data only: a header then the attacks of every line, square and occupancy,
+in the order the tables are built, each as a little-endian bitboard.
+Masks are recomputed rather than stored, and a file of another size, or
+with attacks off their line, is rebuilt.
+"""
+
+import os
+import struct
+
+# Line directions as (dy, dx) pairs, one pair per line through a square
+LINES = (
+    ((0, -1), (0, 1)),      # rank
+    ((-1, 0), (1, 0)),      # file
+    ((-1, -1), (1, 1)),     # diagonal
+    ((-1, 1), (1, -1)),     # anti-diagonal
+)
+RANK, FILE, DIAGONAL, ANTI_DIAGONAL = range(4)
+
+TABLES_VERSION = 2
+# Boards with at least that many squares keep their tables on disk
+DISK_CACHE_MIN_SQUARES = 36
+
+_FILE_HEADER = struct.Struct("<4sHHH")
+_MAGIC = b"MCSL"
+
+
+class SliderTables:
+    def __init__(self, row, col, masks, attacks):
+        self.row = row
+        self.col = col
+        # masks[line][sq] is the relevant occupancy of the line through sq
+        self.masks = masks
+        # attacks[line][sq] maps a relevant occupancy to the attacked squares
+        self.attacks = attacks
+
+    def line_attacks(self, line, sq, occupancy):
+        return self.attacks[line][sq][occupancy & self.masks[line][sq]]
+
+    def rook_attacks(self, sq, occupancy):
+        masks = self.masks
+        attacks = self.attacks
+        return (attacks[RANK][sq][occupancy & masks[RANK][sq]]
+                | attacks[FILE][sq][occupancy & masks[FILE][sq]])
+
+    def bishop_attacks(self, sq, occupancy):
+        masks = self.masks
+        attacks = self.attacks
+        return (attacks[DIAGONAL][sq][occupancy & masks[DIAGONAL][sq]]
+                | attacks[ANTI_DIAGONAL][sq][occupancy & masks[ANTI_DIAGONAL][sq]])
+
+    def queen_attacks(self, sq, occupancy):
+        return self.rook_attacks(sq, occupancy) | self.bishop_attacks(sq, occupancy)
+
+
+def _ray(row, col, sq, dy, dx):
+    # Squares from sq (excluded) to the edge of the board
+    x, y = sq % col, sq // col
+    squares = []
+    x, y = x + dx, y + dy
+    while 0 <= x < col and 0 <= y < row:
+        squares.append(y * col + x)
+        x, y = x + dx, y + dy
+    return squares
+
+
+def _subsets(mask):
+    # Carry-rippler enumeration of every subset of mask, 0 included
+    subset = 0
+    while True:
+        yield subset
+        subset = (subset - mask) & mask
+        if subset == 0:
+            return
+
+
+def _line_rays(row, col):
+    # rays[line][sq] and the relevant occupancy masks[line][sq]
+    rays = []
+    masks = []
+    for directions in LINES:
+        line_rays = []
+        line_masks = []
+        for sq in range(row * col):
+            square_rays = [_ray(row, col, sq, dy, dx) for dy, dx in directions]
+            mask = 0
+            for ray in square_rays:
+                for to in ray[:-1]:
+                    mask |= 1 << to
+            line_rays.append(square_rays)
+            line_masks.append(mask)
+        rays.append(line_rays)
+        masks.append(tuple(line_masks))
+    return rays, tuple(masks)
+
+
+def generate_slider_tables(row, col):
+    """ Build the tables of a row x col board from scratch """
+    rays, masks = _line_rays(row, col)
+    attacks = []
+    for line in range(len(LINES)):
+        line_attacks = []
+        for sq in range(row * col):
+            table = {}
+            for occupancy in _subsets(masks[line][sq]):
+                attack = 0
+                for ray in rays[line][sq]:
+                    for to in ray:
+                        attack |= 1 << to
+                        if occupancy & (1 << to):
+                            break
+                table[occupancy] = attack
+            line_attacks.append(table)
+        attacks.append(tuple(line_attacks))
+
+    return SliderTables(row, col, masks, tuple(attacks))
+
+
+def dump_slider_tables(tables, f):
+    """ Write the tables to a binary file object in the data-only disk cache format """
+    width = (tables.row * tables.col + 7) // 8
+    f.write(_FILE_HEADER.pack(_MAGIC, TABLES_VERSION, tables.row, tables.col))
+    for line in range(len(LINES)):
+        for sq, table in enumerate(tables.attacks[line]):
+            f.write(b"".join(table[occupancy].to_bytes(width, "little")
+                             for occupancy in _subsets(tables.masks[line][sq])))
+
+
+def parse_slider_tables(row, col, data):
+    """ Tables of a row x col board from bytes of dump_slider_tables, ValueError if they don't fit the board """
+    if _FILE_HEADER.unpack_from(data, 0) != (_MAGIC, TABLES_VERSION, row, col):
+        raise ValueError(f"Not {row}x{col} slider tables of version {TABLES_VERSION}")
+    rays, masks = _line_rays(row, col)
+    width = (row * col + 7) // 8
+    expected = _FILE_HEADER.size + width * sum(1 << bin(mask).count("1") for line in masks for mask in line)
+    if len(data) != expected:
+        raise ValueError(f"Slider tables of {len(data)} bytes, expected {expected}")
+
+    offset = _FILE_HEADER.size
+    attacks = []
+    for line in range(len(LINES)):
+        line_attacks = []
+        for sq in range(row * col):
+            reach = 0
+            for ray in rays[line][sq]:
+                for to in ray:
+                    reach |= 1 << to
+            table = {}
+            for occupancy in _subsets(masks[line][sq]):
+                attack = int.from_bytes(data[offset:offset + width], "little")
+                offset += width
+                if attack & ~reach:
+                    raise ValueError(f"Attacks off the line of square {sq}")
+                table[occupancy] = attack
+            line_attacks.append(table)
+        attacks.append(tuple(line_attacks))
+    return SliderTables(row, col, masks, tuple(attacks))
+
+
+def cache_dir():
+    """ Directory of the on-disk tables, $MINI_CHESS_CACHE_DIR, None to keep them in memory only """
+    return os.environ.get("MINI_CHESS_CACHE_DIR") or None
+
+
+def load_slider_tables(row, col):
+    """ Tables of a row x col board, read from or written to the disk cache on larger boards if enabled """
+    directory = cache_dir()
+    if directory is None or row * col < DISK_CACHE_MIN_SQUARES:
+        return generate_slider_tables(row, col)
+
+    path = os.path.join(directory, f"sliders_{row}x{col}_v{TABLES_VERSION}.bin")
+    try:
+        with open(path, "rb") as f:
+            return parse_slider_tables(row, col, f.read())
+    except (OSError, ValueError, struct.error):
+        pass
+
+    tables = generate_slider_tables(row, col)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Write then rename so concurrent workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            dump_slider_tables(tables, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return tables
+
+
+# Reference ray walkers, one bit at a time, used to cross-check the tables
+
+def walk_row(geometry, bit_digit, board, enemy):
+    pos = 1 << bit_digit
+    valid_row_bits = pos ^ geometry.board_mask[bit_digit // geometry.col]
+    move_mask = 0
+    attack_mask = 0
+
+    to_left = pos >> 1
+    while to_left & valid_row_bits:
+        if to_left & board:
+            if to_left & enemy:
+                attack_mask |= to_left
+            break
+        move_mask |= to_left
+        to_left >>= 1
+
+    to_right = pos << 1
+    while to_right & valid_row_bits:
+        if to_right & board:
+            if to_right & enemy:
+                attack_mask |= to_right
+            break
+        move_mask |= to_right
+        to_right <<= 1
+
+    return move_mask, attack_mask
+
+
+def walk_col(geometry, bit_digit, board, enemy):
+    pos = 1 << bit_digit
+    col = geometry.col
+    full_mask = geometry.full_mask
+    move_mask = 0
+    attack_mask = 0
+
+    to_up = pos >> col
+    while to_up & full_mask:
+        if to_up & board:
+            if to_up & enemy:
+                attack_mask |= to_up
+            break
+        move_mask |= to_up
+        to_up >>= col
+
+    to_down = pos << col
+    while to_down & full_mask:
+        if to_down & board:
+            if to_down & enemy:
+                attack_mask |= to_down
+            break
+        move_mask |= to_down
+        to_down <<= col
+
+    return move_mask, attack_mask
+
+
+def walk_diag(geometry, bit_digit, board, enemy):
+    pos = 1 << bit_digit
+    col = geometry.col
+    not_left = geometry.full_mask ^ geometry.left_fence
+    not_right = geometry.full_mask ^ geometry.right_fence
+    move_mask = 0
+    attack_mask = 0
+
+    for shift, fence in ((-(col + 1), not_left), (-(col - 1), not_right),
+                         (col - 1, not_left), (col + 1, not_right)):
+        to = pos
+        while to & fence:
+            to = to << shift if shift > 0 else to >> -shift
+            if to & board:
+                if to & enemy:
+                    attack_mask |= to
+                break
+            move_mask |= to
+
+    return move_mask & geometry.full_mask, attack_mask & geometry.full_mask
+
+
+def check_slider_tables(geometry):
+    """ Compare the tables with the ray walkers on every relevant occupancy, return the mismatches """
+    tables = geometry.sliders
+    full_mask = geometry.full_mask
+    # Alternate blocker colors so both stops and captures get covered
+    alternate = sum(1 << sq for sq in range(0, geometry.squares, 2))
+    mismatches = []
+    walkers = ((walk_row, (RANK,)), (walk_col, (FILE,)), (walk_diag, (DIAGONAL, ANTI_DIAGONAL)))
+    for sq in range(geometry.squares):
+        for walk, lines in walkers:
+            relevant = 0
+            ends = 0
+            for line in lines:
+                relevant |= tables.masks[line][sq]
+                for dy, dx in LINES[line]:
+                    ray = _ray(geometry.row, geometry.col, sq, dy, dx)
+                    if ray:
+                        ends |= 1 << ray[-1]
+            for occupancy in _subsets(relevant):
+                for board in (occupancy, occupancy | ends):
+                    for enemy in (board & alternate, board & ~alternate):
+                        expected = walk(geometry, sq, board, enemy)
+                        attack = 0
+                        for line in lines:
+                            attack |= tables.line_attacks(line, sq, board)
+                        got = (attack & ~board & full_mask, attack & enemy)
+                        if got != expected:
+                            mismatches.append((sq, lines, board, expected, got))
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+
+    from .geometry import get_geometry
+
+    # python -m mini_chess.sliders ROW COL: build, cache and cross-check the tables
+    row, col = int(sys.argv[1]), int(sys.argv[2])
+    mismatches = check_slider_tables(get_geometry(row, col))
+    print(f"{row}x{col}: {len(mismatches)} mismatches")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,416 @@
+"""
+Endgame tablebases of small boards, solved by retrograde analysis.
+
+A table holds every placement of a piece set, e.g. "KQk" or "KRkn" with
+white's pieces in upper case and both kings, with either side to move, and
+its value for the side to move: a win or a loss in a number of plies, or a
+draw. A king capture ends the game, so a win in 1 captures the king.
+
+Rules are those of move_time 1 played as in perft: the side to move pushes
+a move, staying included, the piece lands on the next tick and the turn
+changes, so no piece is ever in flight between plies. Positions of delayed
+modes also depend on the pieces in flight and their ticks left, a state
+space far too large to enumerate. Tables answer None for them, as for
+games of another move_time, and engines fall back to searching them.
+Captures and promotions lead to smaller or other piece sets, built first.
+
+Positions are indexed by a minimal perfect hash of the placements of
+distinct squares, side * P + rank, P being the count of placements and
+rank the mixed radix number of each piece's square among the squares left
+by the pieces before it, in table order: white king, white pieces by piece
+code, black king, black pieces by piece code, then by square.
+
+A table file is a header (see _HEADER) followed by one uint16 per position:
+0 a draw, n a win in n plies, LOSS | n a loss in n plies, INVALID for
+placements that can't happen, pawns on their promotion row. Tablebase maps
+it with mmap, and probe() reads one value in O(1).
+
+Run python -m mini_chess.tablebase KQk KRk --out DIR to build tables.
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+
+from .bit_board import BitBoard, PIECE_SYMBOLS, PIECE_CODES, BLACK_OFFSET, PAWN, QUEEN, KING
+
+VERSION = 1
+LOSS = 0x8000
+INVALID = 0xFFFF
+# Results of probe, for the side to move
+WIN, DRAW, LOST = 1, 0, -1
+
+_HEADER = struct.Struct("<4sHBB16sI")
+_MAGIC = b"MCTB"
+
+
+def _order(code):
+    # Kings first within each color
+    color = code // BLACK_OFFSET
+    return color * BLACK_OFFSET * 2 + (0 if code % BLACK_OFFSET == KING else 1 + code)
+
+
+def piece_set_name(codes):
+    """ Canonical name of a piece set given by piece codes, e.g. "KQk" """
+    return "".join(PIECE_SYMBOLS[code] for code in sorted(codes, key=_order))
+
+
+def parse_piece_set(name):
+    """ Piece codes of a piece set name, in table order """
+    codes = []
+    for symbol in name:
+        if symbol not in PIECE_CODES:
+            raise ValueError(f"Unknown piece {symbol!r} in {name!r}")
+        codes.append(PIECE_CODES[symbol])
+    if codes.count(KING) != 1 or codes.count(BLACK_OFFSET + KING) != 1:
+        raise ValueError(f"{name!r} needs one king of each color")
+    return tuple(sorted(codes, key=_order))
+
+
+def _placements(squares, pieces):
+    count = 1
+    for i in range(pieces):
+        count *= squares - i
+    return count
+
+
+def _rank(square_list, squares):
+    index = 0
+    for i, square in enumerate(square_list):
+        index = index * (squares - i) + square - sum(1 for before in square_list[:i] if before < square)
+    return index
+
+
+def _unrank(index, pieces, squares):
+    digits = []
+    for i in range(pieces - 1, -1, -1):
+        base = squares - i
+        digits.append(index % base)
+        index //= base
+    digits.reverse()
+    square_list = []
+    for digit in digits:
+        # The digit-th square not taken yet
+        square = digit
+        for taken in sorted(square_list):
+            if taken <= square:
+                square += 1
+        square_list.append(square)
+    return square_list
+
+
+def _index(codes_squares, squares):
+    # Name and index of a placement given as (code, square) pairs, side to move apart
+    placed = sorted(codes_squares, key=lambda pair: (_order(pair[0]), pair[1]))
+    name = "".join(PIECE_SYMBOLS[code] for code, _ in placed)
+    return name, _rank([square for _, square in placed], squares)
+
+
+def dependencies(name):
+    """ Piece sets reached by a capture or a promotion from the set, kings kept """
+    codes = parse_piece_set(name)
+    reached = set()
+    for i, code in enumerate(codes):
+        rest = codes[:i] + codes[i + 1:]
+        if code % BLACK_OFFSET != KING:
+            reached.add(piece_set_name(rest))
+        if code % BLACK_OFFSET == PAWN:
+            reached.add(piece_set_name(rest + (code - PAWN + QUEEN,)))
+    return sorted(reached)
+
+
+# State of a worker process, set by _init_worker
+_worker = None
+
+
+def _init_worker(row, col, name, tables):
+    global _worker
+    board = BitBoard(["." * col] * row)
+    _worker = (board, parse_piece_set(name), tables)
+
+
+def _decode(value):
+    # (result, plies) of a stored value
+    if value == 0:
+        return DRAW, 0
+    if value & LOSS:
+        return LOST, value & ~LOSS
+    return WIN, value
+
+
+def _expand(chunk):
+    """
+    Moves of the positions of the chunk: for each, the in-set children, and the best win,
+    longest loss and draw reached by moves leaving the set
+    """
+    start, stop = chunk
+    board, codes, tables = _worker
+    squares = board.row * board.col
+    pieces_count = len(codes)
+    placements = _placements(squares, pieces_count)
+    last_row = board.board_mask[0], board.board_mask[-1]
+
+    children = array("I")
+    ends = array("I")
+    wins = array("H")
+    losses = array("H")
+    draws = bytearray()
+    invalid = bytearray()
+    for position in range(start, stop):
+        side, rank = divmod(position, placements)
+        square_list = _unrank(rank, pieces_count, squares)
+        board.pieces = [0] * len(PIECE_SYMBOLS)
+        board.white_pieces = board.black_pieces = 0
+        for code, square in zip(codes, square_list):
+            bit = 1 << square
+            board.pieces[code] |= bit
+            if code < BLACK_OFFSET:
+                board.white_pieces |= bit
+            else:
+                board.black_pieces |= bit
+
+        win = 0
+        loss = 0
+        draw = 0
+        bad = (board.pieces[PAWN] & last_row[0]) or (board.pieces[BLACK_OFFSET + PAWN] & last_row[1])
+        if not bad:
+            enemy_king = board.pieces[(1 - side) * BLACK_OFFSET + KING]
+            for i, (code, square) in enumerate(zip(codes, square_list)):
+                if code // BLACK_OFFSET != side:
+                    continue
+                targets = board.piece_targets(square, code)
+                if targets & enemy_king:
+                    win = 1
+                    break
+                # Staying hands the same placement to the other side
+                children.append((1 - side) * placements + rank)
+                promotions = last_row[side] if code % BLACK_OFFSET == PAWN else 0
+                for to_digit in board.iter_bits(targets):
+                    bit = 1 << to_digit
+                    moved = code - PAWN + QUEEN if bit & promotions else code
+                    after = [(moved, to_digit)]
+                    captured = False
+                    for j, (other, other_square) in enumerate(zip(codes, square_list)):
+                        if j == i:
+                            continue
+                        if other_square == to_digit:
+                            captured = True
+                            continue
+                        after.append((other, other_square))
+                    if not captured and moved == code:
+                        children.append((1 - side) * placements + _rank(
+                            [to_digit if j == i else s for j, s in enumerate(square_list)], squares))
+                        continue
+
+                    name, child_rank = _index(after, squares)
+                    table = tables[name]
+                    result, plies = _decode(table[(1 - side) * (len(table) // 2) + child_rank])
+                    if result == LOST:
+                        win = plies + 1 if not win else min(win, plies + 1)
+                    elif result == WIN:
+                        loss = max(loss, plies + 1)
+                    else:
+                        draw = 1
+        ends.append(len(children))
+        wins.append(win)
+        losses.append(loss)
+        draws.append(draw)
+        invalid.append(1 if bad else 0)
+    return start, children, ends, wins, losses, bytes(draws), bytes(invalid)
+
+
+def solve(name, row=5, col=5, tables=None, workers=None, chunk_size=4096):
+    """ Values of every position of the piece set as an array('H'), building the sets it depends on into tables """
+    tables = {} if tables is None else tables
+    codes = parse_piece_set(name)
+    name = piece_set_name(codes)
+    if name in tables:
+        return tables[name]
+    for dependency in dependencies(name):
+        solve(dependency, row, col, tables, workers, chunk_size)
+
+    squares = row * col
+    placements = _placements(squares, len(codes))
+    total = 2 * placements
+    chunks = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+    needed = {dependency: tables[dependency] for dependency in dependencies(name)}
+    if workers == 0:
+        _init_worker(row, col, name, needed)
+        results = map(_expand, chunks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, _init_worker, (row, col, name, needed))
+        results = pool.imap(_expand, chunks)
+
+    # Children of each position in CSR form, then the parents by counting sort
+    starts = array("I", [0]) * (total + 1)
+    children = array("I")
+    wins = array("H")
+    losses = array("H")
+    draws = bytearray()
+    invalid = bytearray()
+    try:
+        for start, chunk_children, ends, chunk_wins, chunk_losses, chunk_draws, chunk_invalid in results:
+            base = len(children)
+            children.extend(chunk_children)
+            for offset, end in enumerate(ends):
+                starts[start + offset + 1] = base + end
+            wins.extend(chunk_wins)
+            losses.extend(chunk_losses)
+            draws.extend(chunk_draws)
+            invalid.extend(chunk_invalid)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    parent_starts = array("I", [0]) * (total + 1)
+    for child in children:
+        parent_starts[child + 1] += 1
+    for position in range(total):
+        parent_starts[position + 1] += parent_starts[position]
+    parents = array("I", [0]) * len(children)
+    fill = parent_starts[:-1]
+    for position in range(total):
+        for k in range(starts[position], starts[position + 1]):
+            child = children[k]
+            parents[fill[child]] = position
+            fill[child] += 1
+
+    # Positions are settled by increasing plies; a position loses once all its moves are
+    # settled as wins of the other side, at the longest of them
+    values = array("H", [0]) * total
+    remaining = array("I", (starts[position + 1] - starts[position] for position in range(total)))
+    buckets = {}
+    for position in range(total):
+        if invalid[position]:
+            values[position] = INVALID
+        elif wins[position]:
+            buckets.setdefault(wins[position], []).append((position, False))
+        elif not remaining[position] and not draws[position]:
+            buckets.setdefault(losses[position], []).append((position, True))
+
+    settled = bytearray(total)
+    plies = 1
+    while buckets:
+        for position, lost in buckets.pop(plies, ()):
+            if settled[position]:
+                continue
+            settled[position] = 1
+            values[position] = (LOSS | plies) if lost else plies
+            for k in range(parent_starts[position], parent_starts[position + 1]):
+                parent = parents[k]
+                if settled[parent] or invalid[parent]:
+                    continue
+                if lost:
+                    buckets.setdefault(plies + 1, []).append((parent, False))
+                else:
+                    remaining[parent] -= 1
+                    if not remaining[parent] and not draws[parent] and not wins[parent]:
+                        buckets.setdefault(max(plies, losses[parent] - 1) + 1, []).append((parent, True))
+        plies += 1
+
+    tables[name] = values
+    return values
+
+
+def write_table(path, name, values, row=5, col=5):
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, VERSION, row, col, name.encode(), len(values)))
+        values.tofile(f)
+
+
+class Tablebase:
+    def __init__(self, path):
+        """ Map the table file at path """
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.row, self.col, name, count = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} tablebase")
+        self.name = name.rstrip(b"\0").decode()
+        self.codes = parse_piece_set(self.name)
+        self._values = memoryview(self._map)[_HEADER.size:_HEADER.size + 2 * count].cast("H")
+        self._placements = count // 2
+        # Pieces per code, to tell the games of the set apart
+        self.signature = tuple(self.codes.count(code) for code in range(len(PIECE_SYMBOLS)))
+
+    def close(self):
+        self._values.release()
+        self._map.close()
+
+    def matches(self, game):
+        return ((game.row, game.col) == (self.row, self.col) and game._move_time == 1 and not game._arrivals
+                and tuple(bin(bits).count("1") for bits in game.pieces) == self.signature)
+
+    def probe(self, game):
+        """ (WIN, DRAW or LOST, plies) of the side to move, None if the game isn't a position of the table """
+        if not self.matches(game):
+            return None
+        placed = [(code, square) for code in self.codes for square in game.iter_bits(game.pieces[code])]
+        # Same code pieces were listed once per square, keep one of each
+        placed = sorted(set(placed), key=lambda pair: (_order(pair[0]), pair[1]))
+        rank = _rank([square for _, square in placed], game.row * game.col)
+        value = self._values[game._turn * self._placements + rank]
+        if value == INVALID:
+            return None
+        return _decode(value)
+
+
+class Tablebases:
+    def __init__(self, directory):
+        """ Every table file, *.mctb, of the directory """
+        self.tables = {}
+        for entry in sorted(os.listdir(directory)):
+            if entry.endswith(".mctb"):
+                table = Tablebase(os.path.join(directory, entry))
+                self.tables[(table.row, table.col, table.signature)] = table
+        self.max_pieces = max((len(table.codes) for table in self.tables.values()), default=0)
+
+    def probe(self, game):
+        """ Tablebase.probe of the table of the game's piece set, None without one """
+        if (game._arrivals or game._move_time != 1
+                or bin(game.white_pieces | game.black_pieces).count("1") > self.max_pieces):
+            return None
+        signature = tuple(bin(bits).count("1") for bits in game.pieces)
+        table = self.tables.get((game.row, game.col, signature))
+        return None if table is None else table.probe(game)
+
+
+def build(names, directory, row=5, col=5, workers=None):
+    """ Solve the piece sets and the sets they depend on, write them to directory, return the file paths """
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for name in names:
+        solve(name, row, col, tables, workers)
+    paths = []
+    for name, values in tables.items():
+        path = os.path.join(directory, f"{name}_{row}x{col}.mctb")
+        write_table(path, name, values, row, col)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m mini_chess.tablebase")
+    parser.add_argument("piece_sets", nargs="+", help='e.g. KQk, white in upper case')
+    parser.add_argument("--out", required=True, help="directory of the table files")
+    parser.add_argument("--rows", type=int, default=5)
+    parser.add_argument("--cols", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None, help="processes, 0 to build in process")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    for path in build(args.piece_sets, args.out, args.rows, args.cols, args.workers):
+        print(path)
+    print(f"built in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
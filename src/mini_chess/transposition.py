@@ -0,0 +1,64 @@
+"""
+Fixed-size transposition table keyed by MiniChess.zobrist_hash(), which
+the engine mixes with a key of the game's move_time.
+
+Entries live in a list of 2^n slots indexed by the low bits of the key.
+A slot is replaced when it's empty, holds the same key, was stored by an
+older search (see new_search) or was searched no deeper than the new entry.
+The table holds plain tuples, so several engines in a process may share it.
+"""
+
+# Bounds of a stored value
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class TranspositionTable:
+    def __init__(self, size=1 << 16):
+        """ size is rounded down to a power of two """
+        if size < 1:
+            raise ValueError("Table size must be positive")
+        size = 1 << (size.bit_length() - 1)
+        self._mask = size - 1
+        # (key, depth, age, bound, value, move) or None
+        self._entries = [None] * size
+        self._age = 0
+        self.stored = 0
+
+    def __len__(self):
+        return self.stored
+
+    @property
+    def size(self):
+        return self._mask + 1
+
+    def new_search(self):
+        # Entries of previous searches become replaceable whatever their depth
+        self._age = (self._age + 1) & 0xFF
+
+    def clear(self):
+        self._entries = [None] * self.size
+        self._age = 0
+        self.stored = 0
+
+    def probe(self, key):
+        """ (depth, bound, value, move) stored for the key, None if missing """
+        entry = self._entries[key & self._mask]
+        if entry is None or entry[0] != key:
+            return None
+        return entry[1], entry[3], entry[4], entry[5]
+
+    def store(self, key, depth, bound, value, move=None):
+        index = key & self._mask
+        entry = self._entries[index]
+        if entry is None:
+            self.stored += 1
+        elif entry[0] != key and entry[2] == self._age and entry[1] > depth:
+            # Keep the deeper entry of the current search
+            return False
+        elif entry[0] == key and move is None:
+            # Keep the best move found by a previous search of the position
+            move = entry[5]
+        self._entries[index] = (key, depth, self._age, bound, value, move)
+        return True
@@ -0,0 +1,59 @@
+"""
+Zobrist keys identifying a MiniChess state with a 64-bit int.
+
+The key of a state XORs one key per piece on its square, the side to move
+key when black is to move, and one key per piece in flight, chosen by the
+piece, its target square and the number of ticks left before it lands.
+Two states differing only in the clock share their key as long as every
+piece in flight is as far from landing.
+
+Keys are derived from their indices with splitmix64, so they're the same
+across processes and runs, and shared by all games of the same board size.
+"""
+
+_MASK_64 = (1 << 64) - 1
+
+
+def _splitmix64(seed):
+    z = (seed + 0x9E3779B97F4A7C15) & _MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return z ^ (z >> 31)
+
+
+class ZobristKeys:
+    def __init__(self, squares, piece_count=12):
+        self.squares = squares
+        self.piece_count = piece_count
+        # pieces[code][bit_digit]
+        self.pieces = tuple(tuple(_splitmix64(code * squares + bit_digit) for bit_digit in range(squares))
+                            for code in range(piece_count))
+        self.turn = _splitmix64(_MASK_64)
+        # in-flight tables by ticks left, built on first use
+        self._in_flight = {}
+
+    def in_flight(self, ticks_left):
+        """ Keys of pieces landing in ticks_left ticks, indexed [code][bit_digit] """
+        table = self._in_flight.get(ticks_left)
+        if table is None:
+            base = (ticks_left + 1) * self.piece_count * self.squares
+            table = tuple(tuple(_splitmix64(base + code * self.squares + bit_digit)
+                                for bit_digit in range(self.squares))
+                          for code in range(self.piece_count))
+            self._in_flight[ticks_left] = table
+        return table
+
+    def move_time(self, move_time):
+        """ Key of the move_time of a game, for tables shared by games of different move times """
+        return _splitmix64(_MASK_64 - move_time)
+
+
+_KEYS = {}
+
+
+def get_zobrist_keys(squares):
+    """ Shared ZobristKeys of a board with that many squares """
+    keys = _KEYS.get(squares)
+    if keys is None:
+        keys = _KEYS[squares] = ZobristKeys(squares)
+    return keys